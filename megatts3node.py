@@ -1,14 +1,14 @@
 import json
+import logging
 import os
-import librosa
 import numpy as np
 import torch
+import torch.nn.functional as F
 import torchaudio
 from typing import List, Union, Optional
 from tn.chinese.normalizer import Normalizer as ZhNormalizer
 from tn.english.normalizer import Normalizer as EnNormalizer
 from langdetect import detect as classify_language
-import pyloudnorm as pyln
 import folder_paths
 import gc
 import re
@@ -18,9 +18,16 @@ if current_dir not in sys.path:
     sys.path.append(current_dir)
 
 from tts.modules.ar_dur.commons.nar_tts_modules import LengthRegulator
-from tts.frontend_function import g2p, align, make_dur_prompt, dur_pred, prepare_inputs_for_dit
-from tts.utils.audio_utils.io import convert_to_wav_bytes, combine_audio_segments
+from tts.frontend_function import g2p_batch, align, make_dur_prompt, dur_pred_batch, prepare_inputs_for_dit, make_dit_batches, collate_dit_inputs
+from tts.utils.audio_utils.io import combine_audio_segments, combine_latent_segments, load_waveform
+from tts.utils.audio_utils.loudness import integrated_loudness, normalize_loudness
 from tts.utils.commons.ckpt_utils import load_ckpt
+from tts.utils.commons.prompt_cache import PromptStateCache, audio_fingerprint, file_fingerprint, hash_bytes
+from tts.utils.commons.g2p_cache import G2PCache
+from tts.modules.llm_dit.solvers import ODE_SOLVERS
+from tts.modules.llm_dit.cfg_schedule import CFGSchedule, CFG_SCHEDULES
+from tts.utils.commons.stage_timer import StageTimer
+from tts.utils.commons.speaker_profile import checkpoint_fingerprint, load_speaker_profile, save_speaker_profile, profile_path_for
 from tts.utils.commons.hparams import set_hparams, hparams
 from tts.utils.text_utils.text_encoder import TokenTextEncoder
 from tts.utils.text_utils.split_text import chunk_text_chinese, chunk_text_english, chunk_text_chinesev2
@@ -30,7 +37,9 @@ from tts.utils.commons.hparams import hparams, set_hparams
 models_dir = folder_paths.models_dir
 model_path = os.path.join(models_dir, "TTS")
 speakers_dir = os.path.join(model_path, "speakers")
-cache_dir = folder_paths.get_temp_directory()
+logger = logging.getLogger(__name__)
+# 设置环境变量 MEGATTS3_PROFILE=1 记录各阶段耗时 (每个阶段前后同步 CUDA, 略慢)
+PROFILE = os.environ.get('MEGATTS3_PROFILE', '0') not in ('', '0')
 
 def get_all_files(
     root_dir: str,
@@ -105,6 +114,7 @@ class MegaTTS3DiTInfer():
             dur_ckpt_path='duration_lm',
             g2p_exp_name='g2p',
             precision=torch.float16,
+            prompt_cache_mb=512,
             **kwargs
         ):
         self.sr = 24000
@@ -126,17 +136,22 @@ class MegaTTS3DiTInfer():
         self.zh_normalizer = ZhNormalizer(overwrite_cache=False, remove_erhua=False, remove_interjections=False)
         self.en_normalizer = EnNormalizer(overwrite_cache=False)
 
-        # loudness meter
-        self.loudness_meter = pyln.Meter(self.sr)
-        
         self.ph_ref = None
         self.tone_ref = None
         self.mel2ph_ref = None
         self.vae_latent = None
         self.ctx_dur_tokens = None
         self.incremental_state_dur_prompt = None
+        self.loudness_prompt = None
+
+        # 已预处理的说话人状态, 按音频内容哈希缓存 (LRU)
+        self.prompt_cache = PromptStateCache(int(prompt_cache_mb * 1024 ** 2))
+        self.prompt_key = None
 
-        self.audio_bytes = None
+        # G2P 结果缓存: 整段文本 (LRU) 和按标点切分的子句词典 (保存在磁盘, G2P 模型变化后失效)
+        self.g2p_cache = G2PCache(os.path.join(ckpt_root, 'g2p_lexicon.pt'),
+                                  checkpoint_fingerprint(self.g2p_exp_name, patterns=('*.safetensors', '*.bin', '*.json')),
+                                  start_ph=145)
         
     def clean(self):
         import gc
@@ -147,13 +162,17 @@ class MegaTTS3DiTInfer():
         self.wavvae_de = None
         self.aligner_lm = None
 
-        self.audio_bytes = None
+        self.prompt_cache.clear()
+        self.prompt_key = None
+        self.g2p_cache.save()
+        self.g2p_cache.clear()
         self.ph_ref = None
         self.tone_ref = None
         self.mel2ph_ref = None
         self.vae_latent = None
         self.ctx_dur_tokens = None
         self.incremental_state_dur_prompt = None
+        self.loudness_prompt = None
 
         gc.collect()
         torch.cuda.empty_cache()
@@ -197,8 +216,6 @@ class MegaTTS3DiTInfer():
         load_ckpt(self.aligner_lm, f'{self.frontend_exp_name}', 'model')
         self.aligner_lm.eval()
         self.aligner_lm.to(device)
-        self.kv_cache = None
-        self.hooks = None
 
         ''' Load G2P LM'''
         from transformers import AutoTokenizer, AutoModelForCausalLM
@@ -228,53 +245,81 @@ class MegaTTS3DiTInfer():
 
         self.vae_stride = hp_wavvae.get('vae_stride', 4)
         self.hop_size = hp_wavvae.get('hop_size', 4)
+
+        # 磁盘上的说话人档案依赖这些模型, 模型变化后档案自动失效
+        self.ckpt_key = checkpoint_fingerprint(
+            self.frontend_exp_name, self.wavvae_exp_name, self.dur_exp_name, extra=self.precision)
     
-    def preprocess(self, audio_bytes, latent_file=None, topk_dur=1, **kwargs):
-        if self.audio_bytes != audio_bytes:
-            self.audio_bytes = audio_bytes
-            wav_bytes = convert_to_wav_bytes(audio_bytes)
-
-            ''' Load wav '''
-            wav, _ = librosa.core.load(wav_bytes, sr=self.sr)
-            # Pad wav if necessary
-            ws = hparams['win_size']
-            if len(wav) % ws < ws - 1:
-                wav = np.pad(wav, (0, ws - 1 - (len(wav) % ws)), mode='constant', constant_values=0.0).astype(np.float32)
-            wav = np.pad(wav, (0, 12000), mode='constant', constant_values=0.0).astype(np.float32)
-            self.loudness_prompt = self.loudness_meter.integrated_loudness(wav.astype(float))
-
-            ''' obtain alignments with aligner_lm '''
-            ph_ref, tone_ref, mel2ph_ref = align(self, wav)
-
-            self.kv_cache = None
-            self.hooks = None
-
-            with torch.inference_mode():
-                ''' Forward WaveVAE to obtain: prompt latent '''
-                if self.has_vae_encoder:
-                    if latent_file is None:
-                        wav = torch.FloatTensor(wav)[None].to(self.device)
-                        vae_latent = self.wavvae_en.encode_latent(wav)
-                    else:
-                        vae_latent = torch.from_numpy(np.load(latent_file)).to(self.device)
-                    vae_latent = vae_latent[:, :mel2ph_ref.size(1)//4]
+    def preprocess(self, waveform, sample_rate, latent_file=None, profile_file=None, topk_dur=1, **kwargs):
+        self.dur_model.hparams["infer_top_k"] = topk_dur if topk_dur > 1 else None
+        prompt_key = hash_bytes(audio_fingerprint(waveform, sample_rate), file_fingerprint(latent_file))
+        if prompt_key == self.prompt_key:
+            return
+        state = self.prompt_cache.get(prompt_key)
+        if state is None:
+            if profile_file:
+                state = load_speaker_profile(profile_file, prompt_key, self.ckpt_key, self.dur_model, self.device)
+            if state is None:
+                state = self.build_prompt_state(waveform, sample_rate, latent_file=latent_file)
+                if profile_file:
+                    save_speaker_profile(profile_file, state, prompt_key, self.ckpt_key, self.dur_model)
+            self.prompt_cache.put(prompt_key, state)
+        self.set_prompt_state(state)
+        self.prompt_key = prompt_key
+
+    def build_prompt_state(self, waveform, sample_rate, latent_file=None):
+        ''' Load wav '''
+        # The ComfyUI waveform is downmixed and resampled in torch, on the inference device
+        wav = load_waveform(waveform, sample_rate, self.sr, self.device)
+        # Pad wav if necessary
+        ws = hparams['win_size']
+        if len(wav) % ws < ws - 1:
+            wav = F.pad(wav, (0, ws - 1 - (len(wav) % ws)))
+        wav = F.pad(wav, (0, 12000))
+        loudness_prompt = integrated_loudness(wav, self.sr)
+
+        ''' obtain alignments with aligner_lm '''
+        ph_ref, tone_ref, mel2ph_ref = align(self, wav)
+
+        with torch.inference_mode():
+            ''' Forward WaveVAE to obtain: prompt latent '''
+            if self.has_vae_encoder:
+                if latent_file is None:
+                    vae_latent = self.wavvae_en.encode_latent(wav[None])
                 else:
-                    assert latent_file is not None, "WaveVAE encode model does not exist, an npy file must be provided!!!"
                     vae_latent = torch.from_numpy(np.load(latent_file)).to(self.device)
-                    vae_latent = vae_latent[:, :mel2ph_ref.size(1)//4]
-            
-                ''' Duration Prompting '''
-                self.dur_model.hparams["infer_top_k"] = topk_dur if topk_dur > 1 else None
-                incremental_state_dur_prompt, ctx_dur_tokens = make_dur_prompt(self, mel2ph_ref, ph_ref, tone_ref)
+                vae_latent = vae_latent[:, :mel2ph_ref.size(1)//4]
+            else:
+                assert latent_file is not None, "WaveVAE encode model does not exist, an npy file must be provided!!!"
+                vae_latent = torch.from_numpy(np.load(latent_file)).to(self.device)
+                vae_latent = vae_latent[:, :mel2ph_ref.size(1)//4]
+        
+            ''' Duration Prompting '''
+            incremental_state_dur_prompt, ctx_dur_tokens = make_dur_prompt(self, mel2ph_ref, ph_ref, tone_ref)
+
+        return {
+            'ph_ref': ph_ref.to(self.device),
+            'tone_ref': tone_ref.to(self.device),
+            'mel2ph_ref': mel2ph_ref.to(self.device),
+            'vae_latent': vae_latent.to(self.device),
+            'ctx_dur_tokens': ctx_dur_tokens.to(self.device),
+            'incremental_state_dur_prompt': incremental_state_dur_prompt,
+            'loudness_prompt': loudness_prompt,
+        }
 
-                self.ph_ref = ph_ref.to(self.device)
-                self.tone_ref = tone_ref.to(self.device)
-                self.mel2ph_ref = mel2ph_ref.to(self.device)
-                self.vae_latent = vae_latent.to(self.device)
-                self.ctx_dur_tokens = ctx_dur_tokens.to(self.device)
-                self.incremental_state_dur_prompt = incremental_state_dur_prompt
+    def set_prompt_state(self, state):
+        self.ph_ref = state['ph_ref']
+        self.tone_ref = state['tone_ref']
+        self.mel2ph_ref = state['mel2ph_ref']
+        self.vae_latent = state['vae_latent']
+        self.ctx_dur_tokens = state['ctx_dur_tokens']
+        self.incremental_state_dur_prompt = state['incremental_state_dur_prompt']
+        self.loudness_prompt = state['loudness_prompt']
 
-    def forward(self, texts, time_step, p_w, t_w, dur_disturb=0.1, dur_alpha=1.0, **kwargs):
+    def forward(self, texts, time_step, p_w, t_w, dur_disturb=0.1, dur_alpha=1.0, solver='euler_amo',
+                cfg_schedule='always', cfg_interval_end=0.3, dit_batch_size=4, stitch_latents=False, **kwargs):
+        timer = StageTimer(enabled=PROFILE)
+        nfe, full_cfg_nfe = 0, 0
 
         with torch.inference_mode():
             ''' Generating '''
@@ -289,34 +334,52 @@ class MegaTTS3DiTInfer():
                     input_text = self.zh_normalizer.normalize(input_text)
                     text_segs = chunk_text_chinesev2(input_text, limit=60)
 
-                for seg_i, text in enumerate(text_segs):
-                    ''' G2P '''
-                    ph_pred, tone_pred = g2p(self, text)
-
-                    ''' Duration Prediction '''
-                    mel2ph_pred = dur_pred(self, self.ctx_dur_tokens, self.incremental_state_dur_prompt, ph_pred, tone_pred, seg_i, dur_disturb, dur_alpha, is_first=seg_i==0, is_final=seg_i==len(text_segs)-1)
-                    
-                    inputs = prepare_inputs_for_dit(self, self.mel2ph_ref, mel2ph_pred, self.ph_ref, self.tone_ref, ph_pred, tone_pred, self.vae_latent)
-                    # Speech dit inference
-                    with torch.cuda.amp.autocast(dtype=self.precision, enabled=True):
-                        x = self.dit.inference(inputs, timesteps=time_step, seq_cfg_w=[p_w, t_w]).float()
-                    
+                ''' G2P '''
+                with timer.stage('g2p'):
+                    ph_preds, tone_preds = zip(*g2p_batch(self, text_segs))
+
+                ''' Duration Prediction '''
+                with timer.stage('duration'):
+                    mel2ph_preds = dur_pred_batch(self, self.ctx_dur_tokens, self.incremental_state_dur_prompt, ph_preds, tone_preds, dur_disturb, dur_alpha)
+
+                dit_inputs = [prepare_inputs_for_dit(self, self.mel2ph_ref, mel2ph_pred, self.ph_ref, self.tone_ref, ph_pred, tone_pred, self.vae_latent)
+                              for ph_pred, tone_pred, mel2ph_pred in zip(ph_preds, tone_preds, mel2ph_preds)]
+                latents = [None] * len(dit_inputs)
+                # Speech dit inference, several segments of similar length per batch
+                for seg_ids in make_dit_batches(self, dit_inputs, dit_batch_size):
+                    inputs = collate_dit_inputs(self, [dit_inputs[seg_i] for seg_i in seg_ids])
+                    with timer.stage('dit'), torch.cuda.amp.autocast(dtype=self.precision, enabled=True):
+                        x = self.dit.inference(inputs, timesteps=time_step, seq_cfg_w=[p_w, t_w], solver=solver,
+                                               cfg_schedule=CFGSchedule(cfg_schedule, interval=(0.0, cfg_interval_end))).float()
+                    nfe += self.dit.last_inference_stats['nfe']
+                    full_cfg_nfe += self.dit.last_inference_stats['full_cfg_nfe']
+                    for row, seg_i in enumerate(seg_ids):
+                        latents[seg_i] = x[row:row + 1, :dit_inputs[seg_i]['lat_ctx'].size(1)]
+
+                if stitch_latents:
+                    # Crossfade the generated latents and decode the whole paragraph at once
+                    with timer.stage('post'):
+                        latents = [torch.cat([self.vae_latent, combine_latent_segments(
+                            [x[:, self.vae_latent.size(1):] for x in latents])], dim=1)]
+
+                for x in latents:
                     # WavVAE decode
-                    x[:, :self.vae_latent.size(1)] = self.vae_latent
-                    if self.has_vae_encoder:
-                        wav_pred = self.wavvae_en.decode(x)[0,0].to(torch.float32)
-                    else:
-                        wav_pred = self.wavvae_de.decode(x)[0,0].to(torch.float32)
+                    with timer.stage('wavvae'):
+                        x[:, :self.vae_latent.size(1)] = self.vae_latent
+                        # Only the generated region and the tail of the prompt it depends on are decoded,
+                        # window by window so that long segments run at bounded memory
+                        wavvae = self.wavvae_en if self.has_vae_encoder else self.wavvae_de
+                        wav_pred = torch.cat([chunk[0,0] for chunk in wavvae.decode_stream(x, self.vae_latent.size(1))]).to(torch.float32)
                     
                     ''' Post-processing '''
-                    # Trim prompt wav
-                    wav_pred = wav_pred[self.vae_latent.size(1)*self.vae_stride*self.hop_size:].cpu().numpy()
-                    # Norm generated wav to prompt wav's level
-                    meter = pyln.Meter(self.sr)  # create BS.1770 meter
-                    loudness_pred = self.loudness_meter.integrated_loudness(wav_pred.astype(float))
-                    wav_pred = pyln.normalize.loudness(wav_pred, loudness_pred, self.loudness_prompt)
-                    if np.abs(wav_pred).max() >= 1:
-                        wav_pred = wav_pred / np.abs(wav_pred).max() * 0.95
+                    with timer.stage('post'):
+                        # Norm generated wav to prompt wav's level, on the inference device
+                        loudness_pred = integrated_loudness(wav_pred, self.sr)
+                        wav_pred = normalize_loudness(wav_pred, loudness_pred, self.loudness_prompt)
+                        peak = wav_pred.abs().max()
+                        if peak >= 1:
+                            wav_pred = wav_pred / peak * 0.95
+                        wav_pred = wav_pred.cpu().numpy()
 
                     # Apply hamming window
                     wav_pred_.append(wav_pred)
@@ -324,11 +387,22 @@ class MegaTTS3DiTInfer():
                     gc.collect()
                     torch.cuda.empty_cache()
 
-                wav_pred = combine_audio_segments(wav_pred_, sr=self.sr).astype(np.float32)
-                waveform = torch.tensor(wav_pred)
-                waveforms.append(waveform.cpu())
+                with timer.stage('post'):
+                    wav_pred = combine_audio_segments(wav_pred_, sr=self.sr)
+                waveforms.append(torch.from_numpy(wav_pred))
 
-            return torch.cat(waveforms, dim=0), self.sr
+            self.g2p_cache.save()
+            timer.note('g2p', f"cache hit rate {self.g2p_cache.stats()['hit_rate']:.0%}")
+            timer.note('dit', f'{nfe} NFE, {full_cfg_nfe} with CFG')
+            if PROFILE:
+                logger.info(f"Stage timings: {timer.report()}")
+            # 缓存统计: MEGATTS3_PROFILE 下为 info 级别, 否则为 debug
+            prompt_stats = self.prompt_cache.stats()
+            logger.log(logging.INFO if PROFILE else logging.DEBUG,
+                       f"Prompt cache: {prompt_stats['entries']} voices, {prompt_stats['nbytes'] / 1024 ** 2:.0f}/{prompt_stats['max_bytes'] / 1024 ** 2:.0f} MB, "
+                       f"hit rate {prompt_stats['hit_rate']:.0%}, {prompt_stats['evictions']} evictions; "
+                       f"G2P cache hit rate {self.g2p_cache.stats()['hit_rate']:.0%}")
+            return (waveforms[0] if len(waveforms) == 1 else torch.cat(waveforms, dim=0)), self.sr
 
 
 class MegaTTS3SpeakersPreview:
@@ -338,8 +412,8 @@ class MegaTTS3SpeakersPreview:
         return {
             "required": {"speaker":(speakers,),},}
 
-    RETURN_TYPES = ("AUDIO", "STRING", )
-    RETURN_NAMES = ("audio", "npy_file", )
+    RETURN_TYPES = ("AUDIO", "STRING", "STRING", )
+    RETURN_NAMES = ("audio", "npy_file", "speaker_profile", )
     FUNCTION = "preview"
     CATEGORY = "🎤MW/MW-MegaTTS3"
 
@@ -348,6 +422,8 @@ class MegaTTS3SpeakersPreview:
         latent_file = wav_path.rsplit('.', 1)[0] + '.npy'
         if not os.path.exists(latent_file):
             latent_file = ""
+        # 预处理结果 (对齐, VAE 潜变量, 时长提示) 保存在音频旁, 首次运行时生成
+        profile_file = profile_path_for(wav_path)
 
         waveform, sample_rate = torchaudio.load(wav_path)
         waveform = waveform.unsqueeze(0)
@@ -355,55 +431,13 @@ class MegaTTS3SpeakersPreview:
             "waveform": waveform,
             "sample_rate": sample_rate
         }
-        return (output_audio, latent_file)
-
-
-def cache_audio_tensor(
-    cache_dir,
-    audio_tensor: torch.Tensor,
-    sample_rate: int,
-    filename_prefix: str = "cached_audio_",
-    audio_format: Optional[str] = ".wav"
-) -> str:
-    import tempfile
-    try:
-        with tempfile.NamedTemporaryFile(
-            prefix=filename_prefix,
-            suffix=audio_format,
-            dir=cache_dir,
-            delete=False 
-        ) as tmp_file:
-            temp_filepath = tmp_file.name
-        
-        torchaudio.save(temp_filepath, audio_tensor, sample_rate)
-
-        return temp_filepath
-    except Exception as e:
-        raise Exception(f"Error caching audio tensor: {e}")
-
-def statistical_compare(tensor1, tensor2):
-    """通过统计特征快速比较"""
-    stats1 = {
-        'mean': tensor1.mean(),
-        'std': tensor1.std(),
-        'max': tensor1.max(),
-        'min': tensor1.min()
-    }
-    stats2 = {
-        'mean': tensor2.mean(),
-        'std': tensor2.std(),
-        'max': tensor2.max(),
-        'min': tensor2.min()
-    }
-    return all(torch.allclose(stats1[k], stats2[k], rtol=1e-3) for k in stats1)
+        return (output_audio, latent_file, profile_file)
 
 
 INFER_INS_CACHE = None
 class MegaTTS3Run:
     def __init__(self):
         self.resource_context = None
-        self.audio_tensor = None
-        self.audio_prompt = None
 
     @classmethod
     def INPUT_TYPES(s):
@@ -420,6 +454,14 @@ class MegaTTS3Run:
                 "dialogue_audio_s2":("AUDIO",),
                 "audio_npy_file": ("STRING",  {"forceInput": True, "tooltip": "No `npy_file` will use VAE to encode audio. 不提供 .npy 文件, 将使用 WaveVAE 编码音频"}),
                 "audio_s2_npy_file": ("STRING",  {"forceInput": True, "tooltip": "No `npy_file` will use VAE to encode audio. 不提供 .npy 文件, 将使用 WaveVAE 编码音频"}),
+                "audio_profile_file": ("STRING",  {"forceInput": True, "tooltip": "Preprocessed speaker profile, created on first use and reused afterwards. 说话人档案, 首次使用时生成, 之后跳过预处理"}),
+                "audio_s2_profile_file": ("STRING",  {"forceInput": True, "tooltip": "Preprocessed speaker profile, created on first use and reused afterwards. 说话人档案, 首次使用时生成, 之后跳过预处理"}),
+                "solver": (list(ODE_SOLVERS), {"default": "euler_amo", "tooltip": "ODE solver of the DiT. heun, midpoint and torchdiffeq_midpoint evaluate the model twice per step, torchdiffeq_rk4 four times, the others once. DiT 采样器, heun/midpoint 每步计算两次模型, rk4 四次, 其余一次"}),
+                "cfg_schedule": (CFG_SCHEDULES, {"default": "always", "tooltip": "When to run the guidance branches of the DiT. interval: only for t <= cfg_interval_end; reuse_delta: reuse the guidance once it stops changing. Both trade a little quality for speed. 何时计算 CFG 引导: interval 仅在 t <= cfg_interval_end 时计算; reuse_delta 引导稳定后复用. 二者以少量质量换取速度"}),
+                "cfg_interval_end": ("FLOAT", {"default": 0.3, "min": 0.0, "max": 1.0, "step": 0.05, "tooltip": "End of the guidance interval, t runs from 0 (noise) to 1 (speech). 引导区间终点, t 从 0 (噪声) 到 1 (语音)"}),
+                "dit_batch_size": ("INT", {"default": 4, "min": 1, "max": 32, "tooltip": "Text segments of similar length generated together by the DiT. Lower it if memory runs out. DiT 一次批量生成的文本分段数, 显存不足时调低"}),
+                "stitch_latents": ("BOOLEAN", {"default": False, "tooltip": "Crossfade the segments in latent space and decode each text with a single WavVAE pass, loudness is then normalized over the whole text. 在潜空间交叉淡化各分段, 每段文本只做一次 WavVAE 解码, 响度按整段文本归一化"}),
+                "prompt_cache_mb": ("INT", {"default": 512, "min": 0, "max": 65536, "step": 64, "tooltip": "Memory for preprocessed voices kept between runs (when the model stays loaded), least recently used ones are dropped first. 0 disables it. 保留已预处理说话人的内存上限 (模型不卸载时), 超出时先丢弃最久未用的. 0 为不缓存"}),
             }
         }
 
@@ -428,62 +470,51 @@ class MegaTTS3Run:
     FUNCTION = "clone"
     CATEGORY = "🎤MW/MW-MegaTTS3"
 
-    def clone(self, audio, text, time_step, p_w, t_w, unload_model, audio_npy_file=None, dialogue_audio_s2=None, audio_s2_npy_file=None):
+    def clone(self, audio, text, time_step, p_w, t_w, unload_model, audio_npy_file=None, dialogue_audio_s2=None, audio_s2_npy_file=None,
+              audio_profile_file=None, audio_s2_profile_file=None, solver="euler_amo", cfg_schedule="always", cfg_interval_end=0.3, dit_batch_size=4, stitch_latents=False,
+              prompt_cache_mb=512):
         if not os.path.exists(os.path.join(model_path, "MegaTTS3", 'wavvae', 'model_only_last.ckpt')):
             print("WaveVAE encode model does not exist, an npy file must be provided!!!")
         waveform = audio["waveform"].squeeze(0)
 
         global INFER_INS_CACHE
         if INFER_INS_CACHE is None:
-            INFER_INS_CACHE = MegaTTS3DiTInfer()
+            INFER_INS_CACHE = MegaTTS3DiTInfer(prompt_cache_mb=prompt_cache_mb)
+        else:
+            INFER_INS_CACHE.prompt_cache.resize(int(prompt_cache_mb * 1024 ** 2))
             
         latent_file = audio_npy_file if audio_npy_file else None
+        profile_file = audio_profile_file if audio_profile_file else None
         try:
             import gc
             if dialogue_audio_s2 is None:
-                # 只有音频改变时, 才重新预处理
-                if self.audio_tensor is None or self.audio_prompt is None or statistical_compare(self.audio_tensor, waveform) == False:
-                    self.audio_tensor = waveform
-                    self.audio_prompt = cache_audio_tensor(cache_dir, waveform, audio["sample_rate"])
-
                 texts = [i.strip() for i in re.split(r'\n\s*\n', text.strip()) if i.strip()]
-                with open(self.audio_prompt, 'rb') as file:
-                    file_content = file.read()
-                INFER_INS_CACHE.preprocess(file_content, latent_file=latent_file)
+                # 只有音频改变时, 才重新预处理
+                INFER_INS_CACHE.preprocess(waveform, audio["sample_rate"], latent_file=latent_file, profile_file=profile_file)
 
-                del file_content
                 gc.collect()
                 torch.cuda.empty_cache()
 
-                waveform, sr = INFER_INS_CACHE.forward(texts=texts, time_step=time_step, p_w=p_w, t_w=t_w)
+                waveform, sr = INFER_INS_CACHE.forward(texts=texts, time_step=time_step, p_w=p_w, t_w=t_w, solver=solver, cfg_schedule=cfg_schedule, cfg_interval_end=cfg_interval_end, dit_batch_size=dit_batch_size, stitch_latents=stitch_latents)
                 gc.collect()
                 torch.cuda.empty_cache()
             else:
                 latent_file_2 = audio_s2_npy_file if audio_s2_npy_file else None
-                audio_1 = cache_audio_tensor(cache_dir, waveform, audio["sample_rate"])
-                audio_2 = cache_audio_tensor(cache_dir, dialogue_audio_s2["waveform"].squeeze(0), dialogue_audio_s2["sample_rate"])
-                with open(audio_1, 'rb') as file:
-                    file_content_1 = file.read()
-                with open(audio_2, 'rb') as file:
-                    file_content_2 = file.read()
+                profile_file_2 = audio_s2_profile_file if audio_s2_profile_file else None
+                waveform_2 = dialogue_audio_s2["waveform"].squeeze(0)
 
-                gc.collect()
-                torch.cuda.empty_cache()
-        
                 ress = []
-                for t, a, n in self.get_speaker_text_audio(text, audio_1, audio_2):
+                for t, a, n in self.get_speaker_text_audio(text, 1, 2):
                     texts = [i.strip() for i in re.split(r'\n\s*\n', t.strip()) if i.strip()]
-                    if a == audio_1:
-                        INFER_INS_CACHE.preprocess(file_content_1, latent_file=latent_file)
-                        res_sub, sr = INFER_INS_CACHE.forward(texts=texts, time_step=time_step, p_w=p_w, t_w=t_w)
+                    if a == 1:
+                        INFER_INS_CACHE.preprocess(waveform, audio["sample_rate"], latent_file=latent_file, profile_file=profile_file)
+                        res_sub, sr = INFER_INS_CACHE.forward(texts=texts, time_step=time_step, p_w=p_w, t_w=t_w, solver=solver, cfg_schedule=cfg_schedule, cfg_interval_end=cfg_interval_end, dit_batch_size=dit_batch_size, stitch_latents=stitch_latents)
                         ress.append([res_sub, n])
                     else:
-                        INFER_INS_CACHE.preprocess(file_content_2, latent_file=latent_file_2)
-                        res_sub, sr = INFER_INS_CACHE.forward(texts=texts, time_step=time_step, p_w=p_w, t_w=t_w)
+                        INFER_INS_CACHE.preprocess(waveform_2, dialogue_audio_s2["sample_rate"], latent_file=latent_file_2, profile_file=profile_file_2)
+                        res_sub, sr = INFER_INS_CACHE.forward(texts=texts, time_step=time_step, p_w=p_w, t_w=t_w, solver=solver, cfg_schedule=cfg_schedule, cfg_interval_end=cfg_interval_end, dit_batch_size=dit_batch_size, stitch_latents=stitch_latents)
                         ress.append([res_sub, n])
 
-                del file_content_1
-                del file_content_2
                 gc.collect()
                 torch.cuda.empty_cache()
                 waveform = torch.cat(list(zip(*sorted(ress, key=lambda x: x[1])))[0], dim=0)
@@ -0,0 +1,86 @@
+import pytest
+import torch
+
+from tts.utils.text_utils.ph_tone_convert import map_phone_to_tokendict, split_ph, split_ph_timestamp
+
+# tone ids of the tone_dict: tone_1 is 4, tone_2 is 11, ..., tone_6 is 15
+TONES = torch.LongTensor([4, 11, 12, 13, 14, 15])
+
+
+def reference_split(item):
+    # the scalar codec the vectorized one replaced
+    if 200 <= item <= 788:
+        ph = (item - 200 - 1) // 6 + 3
+        tone = (item - 200 - 1) % 6 + 1
+        tone = 4 if tone == 1 else tone + 9
+    else:
+        ph, tone = item, 3
+    return ph, tone
+
+
+def reference_split_ph(ph_seq):
+    ph_list, tone_list = zip(*[reference_split(item) for item in ph_seq.tolist()]) if len(ph_seq) else ((), ())
+    return torch.LongTensor(ph_list), torch.LongTensor(tone_list)
+
+
+def reference_split_ph_timestamp(ph_timestamp):
+    ph_timestamp = [item - 800 if item >= 800 else item for item in ph_timestamp.tolist()]
+    ph_seq, tone_seq = reference_split_ph(torch.LongTensor(ph_timestamp[0::2]))
+    dur_list, cur_timestamp = [], 0
+    for item in ph_timestamp[1::2]:
+        dur_list.append(item - cur_timestamp)
+        cur_timestamp = item
+    return ph_seq, tone_seq, torch.LongTensor(dur_list), ph_timestamp[-1]
+
+
+def reference_merge(ph_seq, tone_seq):
+    tone_code = {4: 1, 11: 2, 12: 3, 13: 4, 14: 5, 15: 6}
+    return torch.LongTensor([(ph - 3) * 6 + 200 + tone_code.get(tone, tone) if 3 <= ph <= 100 else ph
+                             for ph, tone in zip(ph_seq.tolist(), tone_seq.tolist())])
+
+
+def random_phones(generator, length):
+    # phone dict ids 0~173, Chinese phones (3~100) with one of the six tones, others with tone 3
+    ph_seq = torch.randint(0, 174, (length,), generator=generator)
+    is_chinese = (ph_seq >= 3) & (ph_seq <= 100)
+    tone_seq = torch.where(is_chinese, TONES[torch.randint(0, 6, (length,), generator=generator)], 3)
+    return ph_seq, tone_seq
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_round_trip(seed):
+    generator = torch.Generator().manual_seed(seed)
+    ph_seq, tone_seq = random_phones(generator, int(torch.randint(0, 100, (1,), generator=generator)))
+    merged = map_phone_to_tokendict({'txt_token': ph_seq, 'tone': tone_seq}, pad_bos_eos=False)
+    assert torch.equal(merged, reference_merge(ph_seq, tone_seq))
+    padded = map_phone_to_tokendict({'txt_token': ph_seq, 'tone': tone_seq})
+    assert padded[0] == 798 and padded[-1] == 799 and torch.equal(padded[1:-1], merged)
+    ph_pred, tone_pred = split_ph(merged)
+    assert torch.equal(ph_pred, ph_seq) and torch.equal(tone_pred, tone_seq)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_split_ph_matches_reference(seed):
+    generator = torch.Generator().manual_seed(seed)
+    # any token id, including 200 and ids past the Chinese range
+    ph_seq = torch.randint(0, 1000, (int(torch.randint(0, 100, (1,), generator=generator)),), generator=generator)
+    for actual, expected in zip(split_ph(ph_seq), reference_split_ph(ph_seq)):
+        assert actual.dtype == torch.long and torch.equal(actual, expected)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_split_ph_timestamp_matches_reference(seed):
+    generator = torch.Generator().manual_seed(seed)
+    length = int(torch.randint(1, 100, (1,), generator=generator))
+    merged = map_phone_to_tokendict(dict(zip(('txt_token', 'tone'), random_phones(generator, length))), pad_bos_eos=False)
+    # end frames of the phones, half of them with the 800 offset of the aligner vocabulary
+    ends = torch.randint(0, 8, (length,), generator=generator).cumsum(0)
+    ends = ends + 800 * (torch.rand(length, generator=generator) < 0.5)
+    ph_timestamp = torch.stack([merged, ends], dim=1).flatten()
+    original = ph_timestamp.clone()
+    ph_seq, tone_seq, dur_seq, last = split_ph_timestamp(ph_timestamp)
+    ref_ph_seq, ref_tone_seq, ref_dur_seq, ref_last = reference_split_ph_timestamp(ph_timestamp)
+    assert torch.equal(ph_seq, ref_ph_seq) and torch.equal(tone_seq, ref_tone_seq) and torch.equal(dur_seq, ref_dur_seq)
+    assert int(last) == ref_last
+    # the input is left untouched
+    assert torch.equal(ph_timestamp, original)
@@ -0,0 +1,28 @@
+import pytest
+import torch
+
+from tts.modules.wavvae.decoder.wavvae_v3 import DECODE_CONTEXT, WavVAE_V3
+
+
+@pytest.fixture(scope='module')
+def wavvae():
+    torch.manual_seed(0)
+    return WavVAE_V3(hparams={'melgan_config': {'frame_shift': 240, 'use_tanh': False}}).eval()
+
+
+@pytest.fixture(scope='module')
+def latent_and_full_decode(wavvae):
+    torch.manual_seed(1)
+    latent = torch.randn(1, 32, 32)
+    with torch.no_grad():
+        return latent, wavvae.decode(latent)
+
+
+@pytest.mark.parametrize('start, chunk_frames, context', [(6, 10, DECODE_CONTEXT), (0, 13, 8)])
+def test_decode_stream_matches_full_decode(wavvae, latent_and_full_decode, start, chunk_frames, context):
+    latent, full = latent_and_full_decode
+    with torch.no_grad():
+        chunks = list(wavvae.decode_stream(latent, start, chunk_frames=chunk_frames, context=context))
+    assert len(chunks) == -(-(latent.size(1) - start) // chunk_frames)
+    assert all(chunk.size(-1) % wavvae.latent_hop == 0 for chunk in chunks)
+    torch.testing.assert_close(torch.cat(chunks, dim=-1), full[..., start * wavvae.latent_hop:], rtol=0, atol=1e-5)
@@ -12,49 +12,173 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import inspect
 import torch
 import torch.nn.functional as F
 import whisper
-import librosa
-from copy import deepcopy
+from tts.modules.ar_dur.commons.rot_transformer import fork_incremental_state
 from tts.utils.text_utils.ph_tone_convert import split_ph_timestamp, split_ph
 from tts.utils.audio_utils.align import mel2token_to_dur
+from tts.utils.audio_utils.io import resample
 
 ''' Graphme to phoneme function '''
 def g2p(self, text_inp):
-    # prepare inputs
-    txt_token = self.g2p_tokenizer('<BOT>' + text_inp + '<BOS>')['input_ids']
-    input_ids = torch.LongTensor([txt_token+[145+self.speech_start_idx]]).to(self.device)
+    return g2p_batch(self, [text_inp])[0]
 
-    # model forward
-    with torch.cuda.amp.autocast(dtype=self.precision, enabled=True):
-        outputs = self.g2p_model.generate(input_ids, max_new_tokens=256, do_sample=True, top_k=1, eos_token_id=800+1+self.speech_start_idx)
-    
-    # process outputs
-    ph_tokens = outputs[:, len(txt_token):-1]-self.speech_start_idx
-    ph_pred, tone_pred = split_ph(ph_tokens[0])
-    ph_pred, tone_pred = ph_pred[None, :].to(self.device), tone_pred[None, :].to(self.device)
-    return ph_pred, tone_pred
+def g2p_batch(self, text_inps, max_batch_size=16, speculative=True):
+    # Segments seen before are answered by the G2P cache, the rest are generated together
+    g2p_cache = getattr(self, 'g2p_cache', None)
+    ph_tokens = [g2p_cache.get(text_inp) if g2p_cache is not None else None for text_inp in text_inps]
+    misses = [i for i, tokens in enumerate(ph_tokens) if tokens is None]
+    for i, tokens in zip(misses, g2p_generate(self, [text_inps[i] for i in misses], max_batch_size, speculative)):
+        ph_tokens[i] = tokens
+        if g2p_cache is not None:
+            g2p_cache.put(text_inps[i], tokens)
+
+    preds = []
+    for tokens in ph_tokens:
+        ph_pred, tone_pred = split_ph(tokens)
+        preds.append((ph_pred[None, :].to(self.device), tone_pred[None, :].to(self.device)))
+    return preds
+
+def g2p_generate(self, text_inps, max_batch_size=16, speculative=True):
+    # The segments are left-padded and generated together, each row stops at its own eos token
+    eos_token_id = 800+1+self.speech_start_idx
+    g2p_cache = getattr(self, 'g2p_cache', None)
+    ph_tokens_list = []
+    for batch_start in range(0, len(text_inps), max_batch_size):
+        batch_texts = text_inps[batch_start:batch_start + max_batch_size]
+        # prepare inputs
+        txt_tokens = [self.g2p_tokenizer('<BOT>' + text_inp + '<BOS>')['input_ids'] + [145+self.speech_start_idx] for text_inp in batch_texts]
+        max_len = max(len(txt_token) for txt_token in txt_tokens)
+        input_ids = torch.LongTensor([[eos_token_id] * (max_len - len(txt_token)) + txt_token for txt_token in txt_tokens]).to(self.device)
+        attention_mask = torch.LongTensor([[0] * (max_len - len(txt_token)) + [1] * len(txt_token) for txt_token in txt_tokens]).to(self.device)
+        # at most 4 phones per character (~2 for Chinese, ~1 for English)
+        max_new_tokens = [min(4 * len(text_inp) + 32, 256) for text_inp in batch_texts]
+
+        # speculative decoding drafts the phones of the clauses already in the G2P lexicon; it syncs
+        # with the device on every step, so it is used only if a segment of the batch has such a clause
+        drafter = None
+        can_draft = [g2p_cache.can_draft(text_inp) for text_inp in batch_texts] if speculative and g2p_cache is not None else []
+        if any(can_draft):
+            def drafter(row, tokens, batch_texts=batch_texts, can_draft=can_draft):
+                if not can_draft[row]:
+                    return []
+                phones, complete = g2p_cache.draft(batch_texts[row], [token - self.speech_start_idx for token in tokens])
+                return [phone + self.speech_start_idx for phone in phones] + ([eos_token_id] if complete else [])
+
+        # model forward, with HuggingFace generate if transformers is too old for greedy_decode
+        with torch.cuda.amp.autocast(dtype=self.precision, enabled=True):
+            if supports_greedy_decode(self.g2p_model):
+                outputs = greedy_decode(self.g2p_model, input_ids, attention_mask, max_new_tokens, eos_token_id, drafter)
+            else:
+                outputs = self.g2p_model.generate(input_ids, attention_mask=attention_mask, max_new_tokens=max(max_new_tokens), do_sample=False,
+                                                  eos_token_id=eos_token_id, pad_token_id=eos_token_id)[:, input_ids.size(1):]
+
+        # process outputs, from the last prompt token up to the eos token (or without the last token if there is none)
+        outputs = torch.cat([input_ids[:, -1:], outputs], 1).cpu()
+        for ph_tokens, n_tokens in zip(outputs, max_new_tokens):
+            ph_tokens = ph_tokens[:n_tokens + 1]
+            eos_pos = (ph_tokens == eos_token_id).nonzero()
+            ph_tokens_list.append(ph_tokens[:eos_pos[0, 0] if len(eos_pos) > 0 else -1]-self.speech_start_idx)
+    return ph_tokens_list
+
+def supports_greedy_decode(model):
+    ''' greedy_decode needs transformers' StaticCache and the `logits_to_keep` argument of the model forward '''
+    try:
+        from transformers import StaticCache  # noqa: F401
+    except ImportError:
+        return False
+    return 'logits_to_keep' in inspect.signature(model.forward).parameters
+
+@torch.no_grad()
+def greedy_decode(model, input_ids, attention_mask, max_new_tokens, eos_token_id, drafter=None, max_draft=32, check_every=8):
+    '''
+    Greedy decoding of a HuggingFace causal LM over a KV cache preallocated for the whole sequence.
+    `input_ids` are left-padded and row i generates at most `max_new_tokens[i]` tokens. Returns the
+    new tokens (b, t); a row is filled with `eos_token_id` after its first eos token or its last token.
+
+    With a `drafter(row, tokens)`, which guesses the tokens that follow the ones a row generated so
+    far, decoding is speculative: every step feeds the drafts after the last tokens, and each row
+    keeps the longest prefix of its draft that the LM predicts itself, plus the LM's next token. The
+    result equals plain greedy decoding. Rejected draft tokens stay in the cache, masked out.
+    '''
+    from transformers import StaticCache
+    bsz, prompt_len = input_ids.shape
+    device = input_ids.device
+    max_new_tokens = torch.as_tensor(max_new_tokens, device=device).expand(bsz)
+    total_new_tokens = int(max_new_tokens.max())
+    # rejected drafts may take as many cache slots again as the generated tokens
+    cache_len = prompt_len + total_new_tokens * (2 if drafter is not None else 1)
+    past_key_values = StaticCache(config=model.config, max_batch_size=bsz, max_cache_len=cache_len,
+                                  device=device, dtype=model.dtype)
+    attention_mask = F.pad(attention_mask, [0, cache_len - prompt_len], value=1)
+    step_pos = (attention_mask[:, :prompt_len].cumsum(1) - 1).clamp_min(0)
+    finished = torch.zeros(bsz, dtype=torch.bool, device=device)
+    n_new = torch.zeros(bsz, dtype=torch.long, device=device)
+    tokens, accepted = [], []
+    if drafter is not None:
+        # host copies of the progress of every row, updated with one sync per step
+        generated, done, row_limits = [[] for _ in range(bsz)], [False] * bsz, max_new_tokens.tolist()
+    pos, step_ids = 0, input_ids
+    for step in range(total_new_tokens):
+        drafts = torch.empty(bsz, 0, dtype=torch.long, device=device)
+        if drafter is not None:
+            # every step moves each row on by a token at least, keep room in the cache to finish so
+            steps_left = total_new_tokens - min(len(row) for row, row_done in zip(generated, done) if not row_done) - 1
+            room = min(max_draft, cache_len - pos - step_ids.size(1) - steps_left)
+            row_drafts = [[] if row_done else drafter(i, row)[:room] for i, (row, row_done) in enumerate(zip(generated, done))]
+            n_draft = max(len(row_draft) for row_draft in row_drafts)
+            if n_draft > 0:
+                drafts = torch.LongTensor([row_draft + [eos_token_id] * (n_draft - len(row_draft)) for row_draft in row_drafts]).to(device)
+        n_draft = drafts.size(1)
+        end = pos + step_ids.size(1) + n_draft
+        position_ids = torch.cat([step_pos, step_pos[:, -1:] + torch.arange(1, n_draft + 1, device=device)], 1)
+        logits = model(torch.cat([step_ids, drafts], 1), attention_mask=attention_mask[:, :end], position_ids=position_ids,
+                       past_key_values=past_key_values, use_cache=True, logits_to_keep=n_draft + 1).logits
+        preds = logits.argmax(-1).masked_fill(finished[:, None], eos_token_id)
+        # the LM's predictions are valid up to the first one that differs from the draft
+        n_accept = ((preds[:, :-1] == drafts).cumprod(1).sum(1) if n_draft > 0 else torch.zeros_like(n_new)).masked_fill(finished, 0)
+        valid = torch.arange(n_draft + 1, device=device) <= n_accept[:, None]
+        attention_mask[:, end - n_draft:end] = valid[:, 1:]
+        n_new += n_accept + 1
+        finished |= ((preds == eos_token_id) & valid).any(1) | (max_new_tokens <= n_new)
+        tokens.append(preds)
+        accepted.append(valid)
+        if drafter is not None:
+            for i, ids in enumerate(torch.cat([preds, n_accept[:, None]], 1).tolist()):
+                if not done[i]:
+                    new_ids = ids[:ids[-1] + 1]
+                    generated[i] += new_ids
+                    done[i] = eos_token_id in new_ids or len(generated[i]) >= row_limits[i]
+        pos, step_ids = end, preds.gather(1, n_accept[:, None])
+        step_pos = step_pos[:, -1:] + n_accept[:, None] + 1
+        if drafter is not None:
+            if all(done):
+                break
+        # checking for the end syncs with the device, so not after every token
+        elif step % check_every == check_every - 1 and finished.all():
+            break
+    tokens, accepted = torch.cat(tokens, 1), torch.cat(accepted, 1)
+    if drafter is not None:
+        # move the accepted tokens of every row to the front
+        tokens = tokens.gather(1, (~accepted).to(torch.uint8).argsort(dim=1, stable=True))
+        accepted = torch.arange(tokens.size(1), device=device) < accepted.sum(1, keepdim=True)
+    tokens = tokens.masked_fill(~accepted, eos_token_id)
+    return tokens.masked_fill((tokens == eos_token_id).cumsum(1) > 0, eos_token_id)
 
 ''' Get phoneme2mel align of prompt speech '''
 def align(self, wav):
     with torch.inference_mode():
-        whisper_wav = librosa.resample(wav, orig_sr=self.sr, target_sr=16000)
-        mel = torch.FloatTensor(whisper.log_mel_spectrogram(whisper_wav).T).to(self.device)[None].transpose(1,2)
+        whisper_wav = resample(wav, self.sr, 16000)
+        mel = whisper.log_mel_spectrogram(whisper_wav)[None]
         prompt_max_frame = mel.size(2) // self.fm * self.fm
         mel = mel[:, :, :prompt_max_frame]
-        token = torch.LongTensor([[798]]).to(self.device)
         audio_features = self.aligner_lm.embed_audio(mel)
-        for i in range(768):
-            with torch.cuda.amp.autocast(dtype=self.precision, enabled=True):
-                logits = self.aligner_lm.logits(token, audio_features, None)
-                token_pred = torch.argmax(F.softmax(logits[:, -1], dim=-1), 1)[None]
-                token = torch.cat([token, token_pred], dim=1)
-                if token_pred[0] == 799:
-                    break
-        alignment_tokens = token
+        with torch.cuda.amp.autocast(dtype=self.precision, enabled=True):
+            alignment_tokens = self.aligner_lm.decode_greedy(audio_features, sot_token=798, eot_token=799, max_new_tokens=768)
     
-    ph_ref, tone_ref, dur_ref, _ = split_ph_timestamp(deepcopy(alignment_tokens)[0, 1:-1])
+    ph_ref, tone_ref, dur_ref, _ = split_ph_timestamp(alignment_tokens[0, 1:-1].cpu())
     ph_ref = torch.Tensor(ph_ref)[None].to(self.device)
     tone_ref = torch.Tensor(tone_ref)[None].to(self.device)
     if dur_ref.sum() < prompt_max_frame:
@@ -88,27 +212,47 @@ def make_dur_prompt(self, mel2ph_ref, ph_ref, tone_ref):
     with torch.cuda.amp.autocast(dtype=self.precision, enabled=True):
         _, incremental_state_dur_prompt = self.dur_model.infer(
             ph_ref, {'tone': tone_ref}, None, None, None,
-            ctx_vqcodes=ctx_dur_tokens, spk_pos_ids_flat=dur_spk_pos_ids_flat, return_state=True)
+            ctx_vqcodes=ctx_dur_tokens, spk_pos_ids_flat=dur_spk_pos_ids_flat, return_state=True, prefill=True)
+    # Freeze the prompt keys/values into the read-only prefix shared by all segments
+    incremental_state_dur_prompt = fork_incremental_state(incremental_state_dur_prompt)
     return incremental_state_dur_prompt, ctx_dur_tokens
 
 ''' Duration Prediction '''
-def dur_pred(self, ctx_dur_tokens, incremental_state_dur_prompt, ph_pred, tone_pred, seg_i, dur_disturb, dur_alpha, is_first, is_final):
-    last_dur_token = ctx_dur_tokens[:, -1:]
+def predict_dur_codes(self, ctx_dur_tokens, incremental_state_dur_prompt, ph_preds, tone_preds):
+    # All segments continue the same duration prompt, so they are decoded together as one right-padded batch
+    txt_lens = [ph_pred.shape[1] for ph_pred in ph_preds]
+    max_len = max(txt_lens)
+    ph_batch = torch.cat([F.pad(ph_pred, [0, max_len - ph_pred.shape[1]]) for ph_pred in ph_preds])
+    tone_batch = torch.cat([F.pad(tone_pred, [0, max_len - tone_pred.shape[1]]) for tone_pred in tone_preds])
+    incremental_state_dur = fork_incremental_state(incremental_state_dur_prompt, capacity=max_len + 1)
     last_dur_pos_prompt = ctx_dur_tokens.shape[1]
-    incremental_state_dur = deepcopy(incremental_state_dur_prompt)
-    txt_len = ph_pred.shape[1]
-    dur_spk_pos_ids_flat = range(last_dur_pos_prompt, last_dur_pos_prompt + txt_len)
-    dur_spk_pos_ids_flat = torch.LongTensor([dur_spk_pos_ids_flat]).to(self.device)
-    last_dur_pos_prompt = last_dur_pos_prompt + txt_len
+    dur_spk_pos_ids_flat = torch.arange(last_dur_pos_prompt, last_dur_pos_prompt + max_len, device=self.device)[None]
 
     with torch.cuda.amp.autocast(dtype=self.precision, enabled=True):
-        dur_pred = self.dur_model.infer(
-            ph_pred, {'tone': tone_pred}, None, None, None,
+        dur_codes = self.dur_model.infer_batch(
+            ph_batch, {'tone': tone_batch},
             incremental_state=incremental_state_dur,
-            first_decoder_inp=last_dur_token,
+            first_decoder_inp=ctx_dur_tokens[:, -1:],
             spk_pos_ids_flat=dur_spk_pos_ids_flat,
         )
+    return [dur_codes[i:i + 1, :txt_len] for i, txt_len in enumerate(txt_lens)]
 
+def dur_pred(self, ctx_dur_tokens, incremental_state_dur_prompt, ph_pred, tone_pred, seg_i, dur_disturb, dur_alpha, is_first, is_final):
+    dur_pred = predict_dur_codes(self, ctx_dur_tokens, incremental_state_dur_prompt, [ph_pred], [tone_pred])[0]
+    return dur_codes_to_mel2ph(self, dur_pred, ph_pred, dur_disturb, dur_alpha, is_first, is_final)
+
+def dur_pred_batch(self, ctx_dur_tokens, incremental_state_dur_prompt, ph_preds, tone_preds, dur_disturb, dur_alpha, max_batch_size=32):
+    mel2ph_preds = []
+    for i in range(0, len(ph_preds), max_batch_size):
+        dur_preds = predict_dur_codes(self, ctx_dur_tokens, incremental_state_dur_prompt,
+                                      ph_preds[i:i + max_batch_size], tone_preds[i:i + max_batch_size])
+        for seg_i, dur_pred in enumerate(dur_preds, start=i):
+            mel2ph_preds.append(dur_codes_to_mel2ph(
+                self, dur_pred, ph_preds[seg_i], dur_disturb, dur_alpha,
+                is_first=seg_i == 0, is_final=seg_i == len(ph_preds) - 1))
+    return mel2ph_preds
+
+def dur_codes_to_mel2ph(self, dur_pred, ph_pred, dur_disturb, dur_alpha, is_first, is_final):
     dur_pred = dur_pred - 1
     dur_pred = dur_pred.clamp(0, self.hp_dur_model['dur_code_size'] - 1)
     # if is_final:
@@ -178,4 +322,33 @@ def prepare_inputs_for_dit(self, mel2ph_ref, mel2ph_pred, ph_ref, tone_ref, ph_p
         "lat_ctx": vae_latent_ * ctx_mask,
         "ctx_mask": ctx_mask,
         "dur": mel2ph_pred,
-    }
\ No newline at end of file
+    }
+def make_dit_batches(self, dit_inputs, max_batch_size, max_pad_ratio=0.25):
+    # Length-bucket the segments: sort by frame count and cut a new batch when it is full or a segment
+    # would be padded by more than `max_pad_ratio` of its length
+    frm_lens = [inputs['lat_ctx'].size(1) for inputs in dit_inputs]
+    batches = []
+    for seg_i in sorted(range(len(dit_inputs)), key=lambda i: frm_lens[i]):
+        if len(batches) == 0 or len(batches[-1]) >= max_batch_size \
+                or frm_lens[seg_i] > frm_lens[batches[-1][0]] * (1 + max_pad_ratio):
+            batches.append([])
+        batches[-1].append(seg_i)
+    return batches
+
+def collate_dit_inputs(self, dit_inputs):
+    # Right-pad the CFG batches of several segments and group the rows by CFG role
+    if len(dit_inputs) == 1:
+        return dit_inputs[0]
+    max_ph_len = max(inputs['phone'].size(1) for inputs in dit_inputs)
+    max_frm_len = max(inputs['lat_ctx'].size(1) for inputs in dit_inputs)
+    max_mel_len = max(inputs['dur'].size(1) for inputs in dit_inputs)
+    batch = {}
+    for key, length in [('phone', max_ph_len), ('tone', max_ph_len), ('dur', max_mel_len)]:
+        batch[key] = torch.cat([F.pad(inputs[key][role:role + 1], [0, length - inputs[key].size(1)])
+                                for role in range(3) for inputs in dit_inputs])
+    for key in ['lat_ctx', 'ctx_mask']:
+        batch[key] = torch.cat([F.pad(inputs[key][role:role + 1], [0, 0, 0, max_frm_len - inputs[key].size(1)])
+                                for role in range(3) for inputs in dit_inputs])
+    frm_lens = torch.tensor([inputs['lat_ctx'].size(1) for inputs in dit_inputs], device=self.device).repeat(3)
+    batch['frame_mask'] = torch.arange(max_frm_len, device=self.device)[None] < frm_lens[:, None]
+    return batch
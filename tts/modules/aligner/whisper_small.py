@@ -307,7 +307,50 @@ class Whisper(nn.Module):
 
         self.decoder.apply(install_hooks)
         return cache, hooks
-    
+
+    @torch.no_grad()
+    def decode_greedy(
+        self, audio_features: Tensor, sot_token: int, eot_token: int, max_new_tokens: int, sync_interval: int = 16
+    ) -> Tensor:
+        """
+        Greedy decoding that feeds only the newest token to the decoder on each step. The self-attention
+        keys/values are accumulated by the hooks from `install_kv_cache_hooks`, and the cross-attention
+        keys/values are computed on the first step and reused afterwards. The stop condition is checked
+        on the host every `sync_interval` steps only, so decoding may run a few steps past `eot_token`;
+        those tokens are discarded.
+
+        Returns
+        -------
+        tokens : torch.LongTensor, shape = (batch_size, <= max_new_tokens + 1)
+            `sot_token` followed by the decoded tokens, up to and including the first `eot_token`
+        """
+        n_batch = audio_features.shape[0]
+        tokens = torch.full((n_batch, max_new_tokens + 1), eot_token, dtype=torch.long, device=audio_features.device)
+        tokens[:, 0] = sot_token
+        finished = torch.zeros(n_batch, dtype=torch.bool, device=audio_features.device)
+
+        kv_cache, hooks = self.install_kv_cache_hooks()
+        n_steps = max_new_tokens
+        try:
+            for i in range(max_new_tokens):
+                logits = self.logits(tokens[:, i:i + 1], audio_features, kv_cache)
+                next_token = torch.argmax(F.softmax(logits[:, -1], dim=-1), dim=-1)
+                tokens[:, i + 1] = next_token
+                finished |= next_token == eot_token
+                if (i + 1) % sync_interval == 0 and bool(finished.all()):
+                    n_steps = i + 1
+                    break
+        finally:
+            for hook in hooks:
+                hook.remove()
+
+        tokens = tokens[:, :n_steps + 1]
+        # overwrite everything after the first eot_token of each row, then drop the columns no row needs
+        eot_seen = (tokens[:, 1:] == eot_token).cumsum(dim=-1) > 0
+        tokens[:, 2:][eot_seen[:, :-1]] = eot_token
+        n_keep = min(tokens.shape[1], int((~eot_seen).sum(dim=-1).max()) + 2)
+        return tokens[:, :n_keep]
+
     def sequence_mask(self, seq_lens, max_len=None, device='cpu'):
         b = seq_lens.shape[0]
         if max_len is None:
@@ -23,7 +23,7 @@ from tqdm import tqdm
 
 from tts.modules.ar_dur.commons.layers import Embedding, LayerNorm
 from tts.modules.ar_dur.commons.nar_tts_modules import PosEmb
-from tts.modules.ar_dur.commons.rot_transformer import RotTransformerDecoderLayer
+from tts.modules.ar_dur.commons.rot_transformer import RotTransformerDecoderLayer, RotMultiheadAttention, RotKVArena
 from tts.modules.ar_dur.commons.transformer import SinusoidalPositionalEmbedding
 from tts.modules.ar_dur.commons.rel_transformer import RelTransformerEncoder
 
@@ -190,7 +190,11 @@ class ARDurPredictor(CodePredictor):
     def forward(self, txt_tokens, ling_feas, char_tokens, ph2char, bert_embed,
                 prev_code, spk_id=None, spk_embed=None, mels_timbre=None, mel2ph=None,
                 incremental_state=None, x_ling=None, attn_mask=None, spk_pos_ids_flat=None,
-                prompt_length=None, cache_size=20, streaming=False):
+                prompt_length=None, cache_size=20, streaming=False, prefill=False):
+        """
+        With `prefill=True`, all of `prev_code` is run through the decoder in one pass under a causal
+        mask, and the empty `incremental_state` is filled as if the tokens had been fed one by one.
+        """
         x = self.code_emb(prev_code)
         if x_ling is None:
             x_ling = self.forward_ling_encoder(
@@ -206,7 +210,12 @@ class ARDurPredictor(CodePredictor):
                 prev_code,
                 incremental_state=incremental_state
             )
-        if incremental_state is not None:
+        if prefill:
+            assert incremental_state is not None
+            x_ling = x_ling[:, :x.shape[1]]
+            if spk_pos_ids_flat is not None:
+                spk_pos_ids_flat = spk_pos_ids_flat[:, :x.shape[1]]
+        elif incremental_state is not None:
             x_ling = x_ling[:, x.shape[1] - 1:x.shape[1]]
             if spk_pos_ids_flat is not None:
                 spk_pos_ids_flat = spk_pos_ids_flat[:, x.shape[1] - 1:x.shape[1]]
@@ -228,7 +237,7 @@ class ARDurPredictor(CodePredictor):
         x = x.transpose(0, 1)
 
         for idx, layer in enumerate(self.layers):
-            if incremental_state is None:
+            if incremental_state is None or prefill:
                 self_attn_mask = self.buffered_future_mask(x)
                 if attn_mask is not None:
                     self_attn_mask = self_attn_mask + (1 - attn_mask.float()) * -1e8
@@ -262,10 +271,58 @@ class ARDurPredictor(CodePredictor):
         x = self.project_out_dim(x)
         return x
 
+    def decode_step(self, prev_code, x_ling, incremental_state, rot_cos, rot_sin):
+        """
+        Inference-only decoder step over the kv arenas set up by `init_kv_arena`, with the rotary
+        tables of the step gathered beforehand. Nothing here needs a device-to-host sync.
+
+        prev_code: [B, 1], x_ling: [B, 1, H], rot_cos/rot_sin: [B, 1, 1, H // num_heads]
+        """
+        x = (self.code_emb(prev_code) + x_ling).transpose(0, 1)
+        for layer in self.layers:
+            x = layer.decode_step(x, incremental_state, rot_cos, rot_sin)
+        if not self.use_post_ln:
+            x = self.layer_norm(x)
+        return self.project_out_dim(x.transpose(0, 1))
+
+    def has_kv_arena(self, incremental_state):
+        return all('arena' in layer.op.self_attn._get_input_buffer(incremental_state) for layer in self.layers)
+
+    def init_kv_arena(self, incremental_state, capacity=64):
+        """Make the attention layers cache keys/values in `RotKVArena`s instead of concatenated tensors."""
+        for layer in self.layers:
+            if isinstance(layer.op.self_attn, RotMultiheadAttention):
+                layer.op.self_attn._set_input_buffer(incremental_state, {'arena': RotKVArena(capacity=capacity)})
+        return incremental_state
+
+    def export_incremental_state(self, incremental_state):
+        """Re-key `incremental_state` by layer index, so it can be stored and loaded into another instance."""
+        layer_states = []
+        for layer in self.layers:
+            attn_state = dict(layer.op.self_attn._get_input_buffer(incremental_state))
+            if 'arena' in attn_state:
+                attn_state['arena'] = attn_state['arena'].to_state()
+            layer_states.append({'attn': attn_state, 'ffn': dict(layer.op.ffn._get_input_buffer(incremental_state))})
+        return layer_states
+
+    def import_incremental_state(self, layer_states):
+        incremental_state = {}
+        for layer, layer_state in zip(self.layers, layer_states):
+            attn_state = dict(layer_state['attn'])
+            if 'arena' in attn_state:
+                attn_state['arena'] = RotKVArena.from_state(attn_state['arena'])
+            layer.op.self_attn._set_input_buffer(incremental_state, attn_state)
+            layer.op.ffn._set_input_buffer(incremental_state, dict(layer_state['ffn']))
+        return incremental_state
+
     def infer(self, txt_tokens, ling_feas, char_tokens, ph2char, bert_embed,
               spk_id=None, spk_embed=None, mels_timbre=None,
               incremental_state=None, ctx_vqcodes=None, spk_pos_ids_flat=None, return_state=False,
-              first_step_min=0, return_probs=False, first_decoder_inp=None, dur_disturb=0.0, **kwargs):
+              first_step_min=0, return_probs=False, first_decoder_inp=None, dur_disturb=0.0, prefill=False, **kwargs):
+        """
+        With `prefill=True` and an empty `incremental_state`, the teacher-forced `ctx_vqcodes` prefix is
+        run through the decoder in a single pass instead of one step per token.
+        """
         if incremental_state is None:
             incremental_state = {}
         x_ling = self.forward_ling_encoder(
@@ -279,7 +336,10 @@ class ARDurPredictor(CodePredictor):
 
         decoded = torch.zeros_like(txt_tokens)
         decoded = F.pad(decoded, [1, 0], value=self.code_size + 1)
-        if incremental_state != {}:
+        fresh_state = incremental_state == {}
+        if fresh_state:
+            self.init_kv_arena(incremental_state, capacity=decoded.shape[1])
+        else:
             if first_decoder_inp is None:
                 assert ctx_vqcodes is not None
                 decoded[:, :ctx_vqcodes.shape[1]] = ctx_vqcodes
@@ -287,12 +347,32 @@ class ARDurPredictor(CodePredictor):
             else:
                 decoded[:, :1] = first_decoder_inp
         probs = []
-        for step in range(decoded.shape[1] - 1):
+        start_step = 0
+        if prefill and fresh_state and ctx_vqcodes is not None:
+            start_step = min(ctx_vqcodes.shape[1], decoded.shape[1] - 1)
+            decoded[:, 1:start_step + 1] = ctx_vqcodes[:, :start_step]
             vq_pred = self(txt_tokens, None, None, None, None,
-                           decoded[:, :step + 1], None, None, None,
+                           decoded[:, :start_step], None, None, None,
                            incremental_state=incremental_state, x_ling=x_ling,
-                           spk_pos_ids_flat=spk_pos_ids_flat, **kwargs)
-            probs.append(vq_pred.cpu())
+                           spk_pos_ids_flat=spk_pos_ids_flat, prefill=True, **kwargs)
+            if return_probs:
+                probs.append(vq_pred)
+        fast_decode = (not kwargs and not self.use_pos_embed and spk_pos_ids_flat is not None
+                       and self.has_kv_arena(incremental_state))
+        if fast_decode:
+            rot_cos, rot_sin = self.layers[0].op.self_attn.rotary_embeds.lookup(spk_pos_ids_flat)
+        for step in range(start_step, decoded.shape[1] - 1):
+            if fast_decode:
+                vq_pred = self.decode_step(
+                    decoded[:, step:step + 1], x_ling[:, step:step + 1], incremental_state,
+                    rot_cos[:, :, step:step + 1], rot_sin[:, :, step:step + 1])
+            else:
+                vq_pred = self(txt_tokens, None, None, None, None,
+                               decoded[:, :step + 1], None, None, None,
+                               incremental_state=incremental_state, x_ling=x_ling,
+                               spk_pos_ids_flat=spk_pos_ids_flat, **kwargs)
+            if return_probs:
+                probs.append(vq_pred)
             if ctx_vqcodes is None or step >= ctx_vqcodes.shape[1]:
                 if self.hparams['dur_model_type'] == 'ar_mse':
                     d = vq_pred[:, -1, 0]
@@ -316,9 +396,35 @@ class ARDurPredictor(CodePredictor):
         if return_state:
             return decoded_2d, incremental_state
         if return_probs:
-            return decoded_2d, torch.cat(probs, 1)
+            return decoded_2d, torch.cat(probs, 1).cpu()
         return decoded_2d
 
+    def infer_batch(self, txt_tokens, ling_feas, incremental_state, first_decoder_inp, spk_pos_ids_flat,
+                    first_step_min=0):
+        """
+        Decode a right-padded batch of independent continuations of the same prompt state, one row per
+        text segment. The decoder is causal, so padding only affects the positions past the end of a row,
+        which the caller drops; no attention mask is needed. `incremental_state` must be a fork of a kv
+        arena state (see `fork_incremental_state`), whose prompt is shared by all rows.
+
+        txt_tokens: [B, T], first_decoder_inp: [B or 1, 1], spk_pos_ids_flat: [B or 1, T]
+        """
+        assert self.has_kv_arena(incremental_state) and not self.use_pos_embed
+        x_ling = self.forward_ling_encoder(txt_tokens, ling_feas, None, None, None, None, None, None)
+        decoded = F.pad(torch.zeros_like(txt_tokens), [1, 0], value=self.code_size + 1)
+        decoded[:, :1] = first_decoder_inp
+        rot_cos, rot_sin = self.layers[0].op.self_attn.rotary_embeds.lookup(spk_pos_ids_flat)
+        for step in range(txt_tokens.shape[1]):
+            vq_pred = self.decode_step(
+                decoded[:, step:step + 1], x_ling[:, step:step + 1], incremental_state,
+                rot_cos[:, :, step:step + 1], rot_sin[:, :, step:step + 1])
+            if self.hparams['dur_model_type'] == 'ar_mse':
+                vq_pred = torch.round(vq_pred[:, -1, 0]).long()
+            else:
+                vq_pred = self.sample_one_step(vq_pred).view(-1)
+            decoded[:, step + 1] = torch.clamp_min(vq_pred, first_step_min if step == 0 else 1)
+        return decoded[:, 1:]
+
     def streaming_infer(self, txt_tokens, ling_feas, char_tokens, ph2char, bert_embed,
                         spk_id=None, spk_embed=None, mels_timbre=None,
                         incremental_state=None, ctx_vqcodes=None, spk_pos_ids_flat=None, return_state=False,
@@ -202,6 +202,131 @@ class RotaryEmbeddings(nn.Module):
         # Eq 34 with ordering changed for compatibility.
         return rot_cos * input + rot_sin * self._rotate(input)
 
+    def forward_offset(self, input: torch.Tensor, offset: int):
+        """
+        Apply rotary embeddings to the positions [offset, offset + seq_len). Unlike
+        passing `positions`, this needs no device-to-host sync.
+
+        Shapes:
+            input - (batch_size, num_heads, seq_len, width_per_head)
+            output - (batch_size, num_heads, seq_len, width_per_head)
+        """
+        _, _, seq_len, width = input.shape
+        if self.cos.size(-2) < offset + seq_len:
+            self._create_rotary_embed(width=width, length=offset + seq_len)
+        rot_cos = self.cos[offset:offset + seq_len].view(1, 1, seq_len, width)
+        rot_sin = self.sin[offset:offset + seq_len].view(1, 1, seq_len, width)
+        return rot_cos * input + rot_sin * self._rotate(input)
+
+    def lookup(self, positions: torch.Tensor):
+        """
+        Gather the cos/sin tables of `positions` once, so that `apply` can rotate
+        step after step without indexing or syncing again.
+
+        Shapes:
+            positions - (batch_size, seq_len)
+            output - 2 x (batch_size, 1, seq_len, width_per_head)
+        """
+        batch_size, seq_len = positions.shape
+        max_len = int(positions.max()) + 1
+        if self.cos.size(-2) < max_len:
+            self._create_rotary_embed(width=self.cos.size(-1), length=max_len)
+        positions_flat = positions.reshape(-1)
+        rot_cos = self.cos[positions_flat].view(batch_size, 1, seq_len, -1)
+        rot_sin = self.sin[positions_flat].view(batch_size, 1, seq_len, -1)
+        return rot_cos, rot_sin
+
+    def apply(self, input: torch.Tensor, rot_cos: torch.Tensor, rot_sin: torch.Tensor):
+        return rot_cos * input + rot_sin * self._rotate(input)
+
+
+class RotKVArena:
+    """Append-only key/value storage of one `RotMultiheadAttention` layer for incremental decoding.
+
+    Keys are stored with the rotary embedding already applied, so cached positions are
+    never rotated again. `prefix_key`/`prefix_value` form a read-only block shared by every
+    fork (the speaker prompt), and each fork appends to its own preallocated tail, which
+    grows by doubling instead of being re-concatenated on every step. Forking therefore
+    costs O(1), and a prefix of batch size 1 is broadcast over a batched tail.
+
+    Shapes:
+        prefix_key, prefix_value - (batch_size or 1, num_heads, prefix_len, head_dim)
+    """
+
+    def __init__(self, prefix_key=None, prefix_value=None, capacity=64):
+        self.prefix_key = prefix_key
+        self.prefix_value = prefix_value
+        self.capacity = capacity
+        self.tail_key = None
+        self.tail_value = None
+        self.tail_len = 0
+
+    @property
+    def prefix_len(self):
+        return 0 if self.prefix_key is None else self.prefix_key.shape[2]
+
+    def __len__(self):
+        return self.prefix_len + self.tail_len
+
+    def append(self, k, v):
+        new_len = self.tail_len + k.shape[2]
+        if self.tail_key is None or new_len > self.tail_key.shape[2]:
+            old_capacity = 0 if self.tail_key is None else self.tail_key.shape[2]
+            capacity = max(self.capacity, new_len, 2 * old_capacity)
+            tail_key = k.new_empty(k.shape[:2] + (capacity, k.shape[3]))
+            tail_value = v.new_empty(v.shape[:2] + (capacity, v.shape[3]))
+            if self.tail_len > 0:
+                tail_key[:, :, :self.tail_len] = self.tail_key[:, :, :self.tail_len]
+                tail_value[:, :, :self.tail_len] = self.tail_value[:, :, :self.tail_len]
+            self.tail_key, self.tail_value = tail_key, tail_value
+        self.tail_key[:, :, self.tail_len:new_len] = k
+        self.tail_value[:, :, self.tail_len:new_len] = v
+        self.tail_len = new_len
+
+    def blocks(self):
+        """The cached (key, value) blocks in position order."""
+        blocks = []
+        if self.prefix_key is not None:
+            blocks.append((self.prefix_key, self.prefix_value))
+        if self.tail_len > 0:
+            blocks.append((self.tail_key[:, :, :self.tail_len], self.tail_value[:, :, :self.tail_len]))
+        return blocks
+
+    def freeze(self):
+        """Fold the tail into the shared prefix. The cached contents do not change."""
+        if self.tail_len > 0:
+            self.prefix_key, self.prefix_value = [torch.cat(kv, dim=2) for kv in zip(*self.blocks())]
+            self.tail_key = self.tail_value = None
+            self.tail_len = 0
+        return self
+
+    def fork(self, capacity=None):
+        self.freeze()
+        return RotKVArena(self.prefix_key, self.prefix_value, capacity or self.capacity)
+
+    def to_state(self):
+        self.freeze()
+        return {} if self.prefix_key is None else {'prefix_key': self.prefix_key, 'prefix_value': self.prefix_value}
+
+    @classmethod
+    def from_state(cls, state, capacity=64):
+        return cls(state.get('prefix_key'), state.get('prefix_value'), capacity)
+
+
+def fork_incremental_state(incremental_state, capacity=None):
+    """Fork a decoding state without copying cached keys and values.
+
+    The inner buffers are shallow-copied because layers replace their tensors rather than
+    modifying them in place; kv arenas are forked so each fork appends to its own tail.
+    """
+    forked = {}
+    for key, buffer in incremental_state.items():
+        buffer = dict(buffer)
+        if 'arena' in buffer:
+            buffer['arena'] = buffer['arena'].fork(capacity)
+        forked[key] = buffer
+    return forked
+
 
 class RotMultiheadAttention(MultiheadAttention):
     def __init__(self, embed_dim, num_heads, kdim=None, vdim=None, dropout=0., bias=True,
@@ -297,6 +422,9 @@ class RotMultiheadAttention(MultiheadAttention):
 
         # Apply rot embedding and store incremental_state
         q = self.rotary_embeds(q[None, :], positions=spk_pos_ids_flat)[0]
+        if saved_state is not None and 'arena' in saved_state:
+            attn = self._arena_attention(q, k, v, saved_state['arena'], attn_mask, tgt_len, bsz, embed_dim)
+            return attn, (None, None)
         if saved_state is not None:
             # saved states are stored with shape (bsz, num_heads, seq_len, head_dim)
             if 'prev_key' in saved_state:
@@ -400,6 +528,65 @@ class RotMultiheadAttention(MultiheadAttention):
 
         return attn, (attn_weights, attn_logits)
 
+    def _arena_attention(self, q, k, v, arena, attn_mask, tgt_len, bsz, embed_dim):
+        """Attend over the cached blocks of `arena` after appending the new keys/values.
+
+        The blocks are never concatenated: scores are computed per block and normalized
+        with one softmax. Attention weights are not returned.
+        """
+        k = k.reshape(bsz, self.num_heads, -1, self.head_dim)
+        k = self.rotary_embeds.forward_offset(k, len(arena)).type_as(v)
+        arena.append(k, v.reshape(bsz, self.num_heads, -1, self.head_dim))
+        q = q.reshape(bsz, self.num_heads, tgt_len, self.head_dim)
+
+        blocks = arena.blocks()
+        attn_weights = torch.cat([torch.matmul(q, block_k.transpose(-1, -2)) for block_k, _ in blocks], dim=-1)
+        if attn_mask is not None:
+            attn_weights = attn_weights + attn_mask
+        attn_probs = softmax(attn_weights, dim=-1).type_as(attn_weights)
+        attn = 0
+        offset = 0
+        for block_k, block_v in blocks:
+            attn = attn + torch.matmul(attn_probs[..., offset:offset + block_k.shape[2]], block_v)
+            offset += block_k.shape[2]
+        attn = attn.permute(2, 0, 1, 3).reshape(tgt_len, bsz, embed_dim)
+        return self.out_proj(attn)
+
+    def decode_step(self, x, arena, rot_cos, rot_sin):
+        """Inference-only incremental self-attention over the keys/values cached in `arena`.
+
+        Skips the generic bookkeeping of `forward`: no masks, no attention weights, and the
+        query rotation uses tables gathered beforehand by `RotaryEmbeddings.lookup`.
+
+        A single cached block goes through SDPA. With a shared prefix in front of the tail, the
+        block scores are normalized jointly by hand instead: copying the prefix next to the tail
+        would make every fork cost O(prefix) memory, which the arena is there to avoid.
+
+        Shapes:
+            x - (tgt_len, batch_size, embed_dim)
+            rot_cos, rot_sin - (batch_size, 1, tgt_len, head_dim)
+        """
+        tgt_len, bsz, embed_dim = x.shape
+        q, k, v = [t.reshape(tgt_len, bsz, self.num_heads, self.head_dim).permute(1, 2, 0, 3)
+                   for t in self.in_proj_qkv(x)]
+        q = self.rotary_embeds.apply(q * self.scaling, rot_cos, rot_sin).type_as(v)
+        k = self.rotary_embeds.forward_offset(k, len(arena)).type_as(v)
+        arena.append(k, v)
+        blocks = arena.blocks()
+        if len(blocks) == 1:
+            attn = F.scaled_dot_product_attention(q, blocks[0][0], blocks[0][1], scale=1.0)
+        else:
+            # SDPA cannot merge the per-block results, so normalize the block scores jointly
+            attn_weights = torch.cat([torch.matmul(q, block_k.transpose(-1, -2)) for block_k, _ in blocks], dim=-1)
+            attn_probs = softmax(attn_weights, dim=-1).type_as(v)
+            attn = 0
+            offset = 0
+            for block_k, block_v in blocks:
+                attn = attn + torch.matmul(attn_probs[..., offset:offset + block_k.shape[2]], block_v)
+                offset += block_k.shape[2]
+        attn = attn.permute(2, 0, 1, 3).reshape(tgt_len, bsz, embed_dim)
+        return self.out_proj(attn)
+
 
 class RotMultiheadAttention2(MultiheadAttention):
     def __init__(self, embed_dim, num_heads, kdim=None, vdim=None, dropout=0., bias=True,
@@ -601,6 +788,24 @@ class RotDecSALayer(nn.Module):
             x = self.layer_norm2(x)
         return x, attn_weights
 
+    def decode_step(self, x, incremental_state, rot_cos, rot_sin):
+        """Inference-only version of `forward` for incremental decoding with a kv arena."""
+        arena = self.self_attn._get_input_buffer(incremental_state)['arena']
+        residual = x
+        if not self.post_ln:
+            x = self.layer_norm1(x)
+        x = residual + self.self_attn.decode_step(x, arena, rot_cos, rot_sin)
+        if self.post_ln:
+            x = self.layer_norm1(x)
+
+        residual = x
+        if not self.post_ln:
+            x = self.layer_norm2(x)
+        x = residual + self.ffn(x, incremental_state=incremental_state)
+        if self.post_ln:
+            x = self.layer_norm2(x)
+        return x
+
     def clear_buffer(self, input, encoder_out=None, encoder_padding_mask=None, incremental_state=None):
         self.encoder_attn.clear_buffer(incremental_state)
         self.ffn.clear_buffer(incremental_state)
@@ -642,6 +847,9 @@ class RotTransformerDecoderLayer(nn.Module):
     def forward(self, x, **kwargs):
         return self.op(x, **kwargs)
 
+    def decode_step(self, x, incremental_state, rot_cos, rot_sin):
+        return self.op.decode_step(x, incremental_state, rot_cos, rot_sin)
+
     def clear_buffer(self, *args):
         return self.op.clear_buffer(*args)
 
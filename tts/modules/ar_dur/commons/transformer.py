@@ -104,20 +104,25 @@ class TransformerFFNLayer(nn.Module):
 
     def forward(self, x, incremental_state=None):
         # x: T x B x C
+        tgt_len = x.shape[0]
         if incremental_state is not None:
             saved_state = self._get_input_buffer(incremental_state)
             if 'prev_input' in saved_state:
                 prev_input = saved_state['prev_input']
+                if prev_input.shape[1] != x.shape[1]:
+                    # a prompt state of batch size 1 shared by a batch of continuations
+                    prev_input = prev_input.expand(-1, x.shape[1], -1)
                 x = torch.cat((prev_input, x), dim=0)
-            x = x[-self.kernel_size:]
-            saved_state['prev_input'] = x
+            # keep enough history for the left-padded conv of every new frame (one frame when decoding a step)
+            x = x[-(self.kernel_size - 1 + tgt_len):]
+            saved_state['prev_input'] = x[-self.kernel_size:]
             self._set_input_buffer(incremental_state, saved_state)
 
         x = self.ffn_1(x.permute(1, 2, 0)).permute(2, 0, 1)
         x = x * self.kernel_size ** -0.5
 
         if incremental_state is not None:
-            x = x[-1:]
+            x = x[-tgt_len:]
         if self.act == 'gelu':
             x = F.gelu(x)
         if self.act == 'relu':
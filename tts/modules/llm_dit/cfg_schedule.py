@@ -0,0 +1,61 @@
+import torch
+
+CFG_SCHEDULES = ['always', 'interval', 'reuse_delta']
+
+
+class CFGSchedule:
+    """
+    Decides on which DiT evaluations the guidance rows (cond_txt, uncond) of the CFG batch are run.
+    Skipping them leaves a batch of 1 instead of 3.
+
+    - always: every evaluation runs the full CFG batch.
+    - interval: guidance only while t (0 = noise, 1 = data) lies in `interval`; the conditional
+      row alone is used outside of it.
+    - reuse_delta: the guidance delta (guided minus conditional prediction) is recomputed on every
+      full evaluation. Once it changes by less than `reuse_tol` (relative L2) between two full
+      evaluations, the last delta is added to the conditional prediction for the following
+      `refresh_every - 1` evaluations, after which the delta is checked again.
+    """
+
+    def __init__(self, mode='always', interval=(0.0, 0.3), reuse_tol=0.05, refresh_every=4):
+        if mode not in CFG_SCHEDULES:
+            raise ValueError(f"Unknown CFG schedule '{mode}', available: {', '.join(CFG_SCHEDULES)}")
+        self.mode = mode
+        self.interval = interval
+        self.reuse_tol = reuse_tol
+        self.refresh_every = refresh_every
+        self.delta = None
+        self.delta_stable = False
+        self.since_full = 0
+        self.nfe = 0
+        self.full_nfe = 0
+
+    def run_full(self, t):
+        if self.mode == 'interval':
+            return self.interval[0] <= t <= self.interval[1]
+        if self.mode == 'reuse_delta':
+            return not self.delta_stable or self.since_full >= self.refresh_every - 1
+        return True
+
+    def __call__(self, t, forward_full, forward_cond):
+        """
+        `forward_full()` returns (guided prediction, conditional prediction) from the CFG batch,
+        `forward_cond()` the conditional prediction alone. `t` is a python float.
+        """
+        self.nfe += 1
+        if self.run_full(t):
+            self.full_nfe += 1
+            pred, cond_pred = forward_full()
+            if self.mode == 'reuse_delta':
+                delta = pred - cond_pred
+                if self.delta is not None:
+                    change = torch.linalg.vector_norm(delta - self.delta) / torch.linalg.vector_norm(self.delta).clamp_min(1e-8)
+                    self.delta_stable = change.item() < self.reuse_tol
+                self.delta = delta
+                self.since_full = 0
+            return pred
+        self.since_full += 1
+        cond_pred = forward_cond()
+        if self.mode == 'reuse_delta':
+            return cond_pred + self.delta
+        return cond_pred
@@ -12,10 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import OrderedDict
+
 import torch
 from torch import nn
 
 from tts.modules.llm_dit.cfm import ConditionalFlowMatcher
+from tts.modules.llm_dit.solvers import get_solver
+from tts.modules.llm_dit.cfg_schedule import CFGSchedule
 from tts.modules.ar_dur.commons.layers import Embedding
 from tts.modules.ar_dur.commons.nar_tts_modules import PosEmb
 from tts.modules.ar_dur.commons.rel_transformer import RelTransformerEncoder
@@ -66,6 +70,10 @@ class Diffusion(nn.Module):
             torch.nn.Conv1d(self.encoder_dim, self.encoder_dim, kernel_size=s * 2, stride=s, padding=s // 2)
             for i, s in enumerate([2, 2])
         ])
+        # (timesteps, dtype, device) -> per-step AdaLN modulations, see get_step_modulations()
+        self.modulation_cache = OrderedDict()
+        self.max_modulation_schedules = 4
+        self.last_inference_stats = {}
     
     def forward(self, inputs, sigmas=None, x_noisy=None):
         ctx_mask = inputs['ctx_mask']
@@ -111,70 +119,119 @@ class Diffusion(nn.Module):
         x_ling = self.ph_encoder(ph_tokens, other_embeds=ph_enc_oembed) * ph_nonpadding
         return x_ling
 
-    def _forward(self, x, local_cond, x_ling, timesteps, ctx_mask, dur=None, seq_cfg_w=[1.0,1.0]):
+    def forward_ling_encoder_unique(self, txt_tokens, tone_tokens):
+        """ The CFG rows repeat their phone/tone inputs, so only encode each distinct row once """
+        tokens = torch.stack([txt_tokens, tone_tokens], dim=-1)
+        unique_tokens, inverse = torch.unique(tokens, dim=0, return_inverse=True)
+        if unique_tokens.size(0) == tokens.size(0):
+            return self.forward_ling_encoder(txt_tokens, tone_tokens)
+        x_ling = self.forward_ling_encoder(unique_tokens[..., 0], unique_tokens[..., 1])
+        return x_ling[inverse]
+
+    def get_t_schedule(self, timesteps, device, dtype):
+        # Sway sampling from F5-TTS (https://github.com/SWivid/F5-TTS), 
+        # which is licensed under the MIT License.
+        sway_sampling_coef = -1.0
+        t_schedule = torch.linspace(0, 1, timesteps + 1, device=device, dtype=dtype)
+        if sway_sampling_coef is not None:
+            t_schedule = t_schedule + sway_sampling_coef * (torch.cos(torch.pi / 2 * t_schedule) - 1 + t_schedule)
+        return t_schedule
+
+    @torch.no_grad()
+    def get_step_modulations(self, timesteps, device, dtype):
+        """
+        The AdaLN shift/scale/gate of every layer only depend on the ODE time, which is fixed by the
+        number of steps. Compute them once for every point of the schedule at batch size 1 (they
+        broadcast over the CFG batch) and keep them for the last few schedules used.
+        """
+        key = (timesteps, dtype, torch.device(device))
+        if key not in self.modulation_cache:
+            t_schedule = self.get_t_schedule(timesteps, device, dtype)
+            self.modulation_cache[key] = [
+                self.encoder.modulation(self.f5_time_embed(t_schedule[step_index].to(dtype).unsqueeze(0)))
+                for step_index in range(timesteps + 1)]
+            while len(self.modulation_cache) > self.max_modulation_schedules:
+                self.modulation_cache.popitem(last=False)
+        self.modulation_cache.move_to_end(key)
+        return self.modulation_cache[key]
+
+    def _forward(self, x, local_cond, x_ling, timesteps, ctx_mask, dur=None, seq_cfg_w=[1.0,1.0], cond=None, mods=None, return_cond=False, guidance=True, attn_mask=None):
         """ When we use torchdiffeq, we need to include the CFG process inside _forward() """
         x = x * (1 - ctx_mask)
-        x = self.x_prenet(x) + self.prenet(local_cond) + x_ling
-        pred_v = self.encoder(x, self.f5_time_embed(timesteps), attn_mask=torch.ones((x.size(0), x.size(1)), device=x.device))
+        if cond is None:
+            cond = self.prenet(local_cond) + x_ling
+        x = self.x_prenet(x) + cond
+        # Only padded batches need a mask, otherwise SDPA may use its fast kernels
+        if mods is None:
+            pred_v = self.encoder(x, self.f5_time_embed(timesteps), attn_mask=attn_mask)
+        else:
+            pred_v = self.encoder(x, None, attn_mask=attn_mask, mods=mods)
         pred = self.postnet(pred_v)
+        if not guidance:
+            # the conditional rows alone
+            return pred
 
         """ Perform multi-cond CFG """
         cond_spk_txt, cond_txt, uncond = pred.chunk(3)
         pred = uncond + seq_cfg_w[0] * (cond_txt - uncond) + seq_cfg_w[1] * (cond_spk_txt - cond_txt)
+        if return_cond:
+            return pred, cond_spk_txt
         return pred
 
+    def forward_ling_pre_net(self, x_ling, frame_lens=None):
+        """ x_ling: [B, T_mel, C] -> [B, T_mel // 4, C]. `frame_lens` are the valid mel lengths of a padded batch """
+        x_ling = x_ling.transpose(1, 2)
+        for i, conv in enumerate(self.ling_pre_net):
+            x_ling = conv(x_ling)
+            if frame_lens is not None and i < len(self.ling_pre_net) - 1:
+                # zero the padded frames, as the zero padding of the next conv would be without batching
+                frame_lens = frame_lens // conv.stride[0]
+                x_ling = x_ling * (torch.arange(x_ling.size(2), device=x_ling.device)[None] < frame_lens[:, None])[:, None]
+        return x_ling.transpose(1, 2)
+
     @torch.no_grad()
-    def inference(self, inputs, timesteps=20, seq_cfg_w=[1.0, 1.0], **kwargs):
+    def inference(self, inputs, timesteps=20, seq_cfg_w=[1.0, 1.0], solver='euler_amo', cfg_schedule=None, **kwargs):
+        """
+        The batch holds the CFG rows (cond_spk_txt, cond_txt, uncond) of one or more segments, grouped by role:
+        rows [0, K) are cond_spk_txt, [K, 2K) cond_txt and [2K, 3K) uncond. Batches of segments of different
+        lengths are right-padded, with `inputs['frame_mask']` marking the valid latent frames. Returns the
+        latents of the K segments.
+        """
+        frame_mask = inputs.get('frame_mask')
         # txt embedding
-        x_ling = self.forward_ling_encoder(inputs["phone"], inputs["tone"])
-        x_ling = self.ling_pre_net(expand_states(x_ling, inputs['dur']).transpose(1, 2)).transpose(1, 2)
+        x_ling = self.forward_ling_encoder_unique(inputs["phone"], inputs["tone"])
+        x_ling = expand_states(x_ling, inputs['dur'])
+        x_ling = self.forward_ling_pre_net(x_ling, (inputs['dur'] > 0).sum(1) if frame_mask is not None else None)
 
         # speaker embedding
+        n_segs = inputs['lat_ctx'].size(0) // 3
         ctx_feature = inputs['lat_ctx']
-        ctx_feature[1:, :, :] = 0 # prefix spk cfg
+        ctx_feature[n_segs:, :, :] = 0 # prefix spk cfg
         ctx_mask_emb = self.ctx_mask_proj(inputs['ctx_mask'])
 
         # local conditioning.
         local_cond = torch.cat([ctx_feature, ctx_mask_emb], dim=-1)
         local_cond = self.local_cond_project(local_cond)
+        # the conditioning does not depend on the ODE step
+        cond = self.prenet(local_cond) + x_ling
         
-        ''' Euler ODE solver '''
-        bsz, device, frm_len = (local_cond.size(0), local_cond.device, local_cond.size(1))
-        # Sway sampling from F5-TTS (https://github.com/SWivid/F5-TTS), 
-        # which is licensed under the MIT License.
-        sway_sampling_coef = -1.0
-        t_schedule = torch.linspace(0, 1, timesteps + 1, device=device, dtype=x_ling.dtype)
-        if sway_sampling_coef is not None:
-            t_schedule = t_schedule + sway_sampling_coef * (torch.cos(torch.pi / 2 * t_schedule) - 1 + t_schedule)
-        
-        # AMO sampling implementation for "AMO Sampler: Enhancing Text Rendering with Overshooting" (https://arxiv.org/pdf/2411.19415)
-        def amo_sampling(z_t, t, t_next, v):
-            # Upcast to avoid precision issues when computing prev_sample
-            z_t = z_t.to(torch.float32)
-
-            # Constant definition in Algorithm 1
-            s = t_next
-            c = 3
-
-            # Line 7 in Algorithm 1
-            o = min(t_next + c * (t_next - t), 1)
-            pred_z_o = z_t + (o - t) * v
-
-            # Line 11 in Algorithm 1
-            a = s / o
-            b = ((1 - s) ** 2 - (a * (1 - o)) ** 2) ** 0.5
-            noise_i = torch.randn(size=z_t.shape, device=z_t.device)
-            z_t_next = a * pred_z_o + b * noise_i
-            return z_t_next.to(v.dtype)
-
-        x = torch.randn([1, frm_len, self.out_channels], device=device)
-        for step_index in range(timesteps):
-            x = x.to(torch.float32)
-            sigma = t_schedule[step_index].to(x_ling.dtype)
-            sigma_next = t_schedule[step_index + 1]
-            model_out = self._forward(torch.cat([x] * bsz), local_cond, x_ling, timesteps=sigma.unsqueeze(0), ctx_mask=inputs['ctx_mask'], dur=inputs['dur'], seq_cfg_w=seq_cfg_w)
-            x = amo_sampling(x, sigma, sigma_next, model_out)
-            # Cast sample back to model compatible dtype
-            x = x.to(model_out.dtype)
-        
+        ''' ODE solver '''
+        device, frm_len = (local_cond.device, local_cond.size(1))
+        t_schedule = self.get_t_schedule(timesteps, device, x_ling.dtype)
+        step_mods = self.get_step_modulations(timesteps, device, x_ling.dtype)
+        t_schedule_host = t_schedule.float().tolist()
+        if cfg_schedule is None:
+            cfg_schedule = CFGSchedule()
+
+        def velocity(x, t, step_index=None):
+            mods = step_mods[step_index] if step_index is not None else None
+            t_model = t.to(x_ling.dtype).reshape(1)
+            forward_full = lambda: self._forward(torch.cat([x] * 3), local_cond, x_ling, timesteps=t_model, ctx_mask=inputs['ctx_mask'], dur=inputs['dur'], seq_cfg_w=seq_cfg_w, cond=cond, mods=mods, return_cond=True, attn_mask=frame_mask)
+            forward_cond = lambda: self._forward(x, local_cond[:n_segs], x_ling[:n_segs], timesteps=t_model, ctx_mask=inputs['ctx_mask'][:n_segs], dur=inputs['dur'][:n_segs], seq_cfg_w=seq_cfg_w, cond=cond[:n_segs], mods=mods, guidance=False, attn_mask=frame_mask[:n_segs] if frame_mask is not None else None)
+            t_host = t_schedule_host[step_index] if step_index is not None else float(t)
+            return cfg_schedule(t_host, forward_full, forward_cond)
+
+        x = torch.randn([n_segs, frm_len, self.out_channels], device=device)
+        x = get_solver(solver)(velocity, x, t_schedule)
+        self.last_inference_stats = {'nfe': cfg_schedule.nfe, 'full_cfg_nfe': cfg_schedule.full_nfe}
         return x
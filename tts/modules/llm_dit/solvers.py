@@ -0,0 +1,136 @@
+import math
+
+import torch
+
+# Fixed-grid ODE solvers for the DiT flow. Time runs from 0 (noise) to 1 (data) and the model
+# predicts the velocity dx/dt. A solver is called as
+#     solver(velocity, x, t_schedule) -> x at t_schedule[-1]
+# where `velocity(x, t, step_index=None)` evaluates the model at time `t`; `step_index` may be
+# given when `t == t_schedule[step_index]`, so that precomputed per-step tensors can be used.
+ODE_SOLVERS = {}
+
+# fixed-grid methods of torchdiffeq, available as 'torchdiffeq_<method>'
+TORCHDIFFEQ_METHODS = ['euler', 'midpoint', 'rk4']
+
+
+def register_solver(name):
+    def _register(solver):
+        ODE_SOLVERS[name] = solver
+        return solver
+    return _register
+
+
+def get_solver(name):
+    if name not in ODE_SOLVERS:
+        raise ValueError(f"Unknown ODE solver '{name}', available: {', '.join(ODE_SOLVERS)}")
+    return ODE_SOLVERS[name]
+
+
+@register_solver('euler_amo')
+def euler_amo(velocity, x, t_schedule):
+    """ Euler with AMO overshooting, 1 NFE per step """
+    # AMO sampling implementation for "AMO Sampler: Enhancing Text Rendering with Overshooting" (https://arxiv.org/pdf/2411.19415)
+    def amo_sampling(z_t, t, t_next, v):
+        # Upcast to avoid precision issues when computing prev_sample
+        z_t = z_t.to(torch.float32)
+
+        # Constant definition in Algorithm 1
+        s = t_next
+        c = 3
+
+        # Line 7 in Algorithm 1
+        o = min(t_next + c * (t_next - t), 1)
+        pred_z_o = z_t + (o - t) * v
+
+        # Line 11 in Algorithm 1
+        a = s / o
+        b = ((1 - s) ** 2 - (a * (1 - o)) ** 2) ** 0.5
+        noise_i = torch.randn(size=z_t.shape, device=z_t.device)
+        z_t_next = a * pred_z_o + b * noise_i
+        return z_t_next.to(v.dtype)
+
+    for step_index in range(len(t_schedule) - 1):
+        x = x.to(torch.float32)
+        v = velocity(x, t_schedule[step_index], step_index)
+        x = amo_sampling(x, t_schedule[step_index], t_schedule[step_index + 1], v)
+        # Cast sample back to model compatible dtype
+        x = x.to(v.dtype)
+    return x
+
+
+@register_solver('euler')
+def euler(velocity, x, t_schedule):
+    """ 1 NFE per step """
+    for step_index in range(len(t_schedule) - 1):
+        t, t_next = t_schedule[step_index], t_schedule[step_index + 1]
+        x = x.float() + (t_next - t) * velocity(x, t, step_index).float()
+    return x
+
+
+@register_solver('heun')
+def heun(velocity, x, t_schedule):
+    """ Trapezoidal predictor-corrector, 2 NFE per step """
+    for step_index in range(len(t_schedule) - 1):
+        t, t_next = t_schedule[step_index], t_schedule[step_index + 1]
+        x = x.float()
+        v = velocity(x, t, step_index).float()
+        x_pred = x + (t_next - t) * v
+        v_next = velocity(x_pred, t_next, step_index + 1).float()
+        x = x + (t_next - t) * 0.5 * (v + v_next)
+    return x
+
+
+@register_solver('midpoint')
+def midpoint(velocity, x, t_schedule):
+    """ 2 NFE per step """
+    for step_index in range(len(t_schedule) - 1):
+        t, t_next = t_schedule[step_index], t_schedule[step_index + 1]
+        x = x.float()
+        v = velocity(x, t, step_index).float()
+        t_mid = (t + t_next) / 2
+        x = x + (t_next - t) * velocity(x + (t_mid - t) * v, t_mid).float()
+    return x
+
+
+@register_solver('dpm_2m')
+def dpm_2m(velocity, x, t_schedule):
+    """
+    DPM-Solver++(2M) for the linear flow x_t = t * x_1 + (1 - t) * noise, 1 NFE per step.
+    The data prediction is x_1 = x_t + (1 - t) * v. The first step and the step that ends at t = 1
+    are first order, which for this flow is exactly Euler.
+    """
+    ts = t_schedule.float().tolist()
+    prev_data, prev_h = None, None
+    for step_index in range(len(ts) - 1):
+        t, t_next = ts[step_index], ts[step_index + 1]
+        x = x.float()
+        data = x + (1 - t) * velocity(x, t_schedule[step_index], step_index).float()
+        if t <= 0 or t_next >= 1:
+            # lambda = log(t / (1 - t)) is infinite at the ends of the schedule
+            x = x + (t_next - t) / (1 - t) * (data - x)
+            prev_data, prev_h = None, None
+            continue
+        # exp(-h) with h = lambda_next - lambda
+        exp_neg_h = (1 - t_next) * t / ((1 - t) * t_next)
+        h = -math.log(exp_neg_h)
+        if prev_data is not None:
+            r = prev_h / h
+            data_hat = (1 + 1 / (2 * r)) * data - 1 / (2 * r) * prev_data
+        else:
+            data_hat = data
+        x = (1 - t_next) / (1 - t) * x + t_next * (1 - exp_neg_h) * data_hat
+        prev_data, prev_h = data, h
+    return x
+
+
+def _torchdiffeq_solver(method):
+    def solver(velocity, x, t_schedule):
+        from torchdiffeq import odeint
+        t_schedule = t_schedule.float()
+        return odeint(lambda t, y: velocity(y, t).float(), x.float(), t_schedule, method=method)[-1]
+    solver.__doc__ = f""" torchdiffeq '{method}' on the sampling grid """
+    return solver
+
+
+for _method in TORCHDIFFEQ_METHODS:
+    register_solver(f'torchdiffeq_{_method}')(_torchdiffeq_solver(_method))
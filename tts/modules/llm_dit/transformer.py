@@ -56,9 +56,14 @@ class AdaLNZero(nn.Module):
         self.linear = nn.Linear(dim, dim * 6)
         self.norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
 
-    def forward(self, x, emb=None):
-        emb = self.linear(self.silu(emb))
-        shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = torch.chunk(emb, 6, dim=1)
+    def modulation(self, emb):
+        return self.linear(self.silu(emb))
+
+    def forward(self, x, emb=None, mod=None):
+        # `mod` is a precomputed `modulation(emb)`
+        if mod is None:
+            mod = self.modulation(emb)
+        shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = torch.chunk(mod, 6, dim=1)
         x = self.norm(x) * (1 + scale_msa[:, None]) + shift_msa[:, None]
         return x, gate_msa, shift_mlp, scale_mlp, gate_mlp
 
@@ -70,9 +75,13 @@ class AdaLNZero_Out(nn.Module):
         self.linear = nn.Linear(dim, dim * 2)
         self.norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
 
-    def forward(self, x, emb):
-        emb = self.linear(self.silu(emb))
-        scale, shift = torch.chunk(emb, 2, dim=1)
+    def modulation(self, emb):
+        return self.linear(self.silu(emb))
+
+    def forward(self, x, emb=None, mod=None):
+        if mod is None:
+            mod = self.modulation(emb)
+        scale, shift = torch.chunk(mod, 2, dim=1)
         x = self.norm(x) * (1 + scale)[:, None, :] + shift[:, None, :]
         return x
 
@@ -122,7 +131,9 @@ class Attention(nn.Module):
         keys = xk.transpose(1, 2)  # (bs, n_local_heads, cache_len + seqlen, head_dim)
         values = xv.transpose(1, 2)  # (bs, n_local_heads, cache_len + seqlen, head_dim)
 
-        output = F.scaled_dot_product_attention(xq, keys, values, mask[:, None, None, :], is_causal=False)
+        if mask is not None:
+            mask = mask[:, None, None, :]
+        output = F.scaled_dot_product_attention(xq, keys, values, mask, is_causal=False)
         output = output.transpose(1, 2).contiguous().view(bsz, seqlen, -1)
         return self.wo(output)
 
@@ -174,6 +185,7 @@ class TransformerBlock(nn.Module):
             start_pos: int,
             freqs_cis: torch.Tensor,
             mask: Optional[torch.Tensor],
+            mod: Optional[torch.Tensor] = None,
     ):
         """
         Perform a forward pass through the TransformerBlock.
@@ -183,13 +195,14 @@ class TransformerBlock(nn.Module):
             start_pos (int): Starting position for attention caching.
             freqs_cis (torch.Tensor): Precomputed cosine and sine frequencies.
             mask (torch.Tensor, optional): Masking tensor for attention. Defaults to None.
+            mod (torch.Tensor, optional): Precomputed AdaLN modulation of `t`. Defaults to None.
 
         Returns:
             torch.Tensor: Output tensor after applying attention and feedforward layers.
 
         """
         # pre-norm & modulation for attention input
-        norm, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.attention_norm(x, emb=t)
+        norm, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.attention_norm(x, emb=t, mod=mod)
 
         # attention
         attn_output = self.attention(norm, start_pos, freqs_cis, mask=mask)
@@ -221,10 +234,17 @@ class Transformer(nn.Module):
         )
         self.register_buffer("freqs_cis", torch.view_as_real(freqs_cis), persistent=False)
     
-    def forward(self, x, t, attn_mask, start_pos=0):
+    def modulation(self, t):
+        """ AdaLN modulations of all layers and of the output norm for the time embedding `t` """
+        return [layer.attention_norm.modulation(t) for layer in self.layers] + [self.norm.modulation(t)]
+
+    def forward(self, x, t, attn_mask, start_pos=0, mods=None):
+        # `mods` replaces `t` with precomputed `modulation(t)`
+        if mods is None:
+            mods = self.modulation(t)
         freqs_cis = torch.view_as_complex(self.freqs_cis.float())[start_pos: start_pos + x.size(1)]
         for i, layer in enumerate(self.layers):
-            x = layer(x, t, start_pos, freqs_cis, attn_mask)
-        x = self.norm(x, t)
+            x = layer(x, t, start_pos, freqs_cis, attn_mask, mod=mods[i])
+        x = self.norm(x, mod=mods[-1])
         x = self.out_proj(x)
         return x
\ No newline at end of file
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import argparse
+import math
 import torch
 from torch import nn
 import torch.nn.functional as F
@@ -21,6 +22,11 @@ from tts.modules.wavvae.decoder.seanet_encoder import Encoder
 from tts.modules.wavvae.decoder.diag_gaussian import DiagonalGaussianDistribution
 from tts.modules.wavvae.decoder.hifigan_modules import Generator, Upsample
 
+# latent frames decoded on both sides of every window of `WavVAE_V3.decode_stream`
+DECODE_CONTEXT = 16
+# latent frames per window of `WavVAE_V3.decode_stream` (~10s of audio)
+DECODE_CHUNK_FRAMES = 256
+
 
 class WavVAE_V3(nn.Module):
     def __init__(self, hparams=None):
@@ -36,6 +42,8 @@ class WavVAE_V3(nn.Module):
         self.decoder = Generator(
             input_size_=160, ngf=128, n_residual_layers=4,
             num_band=1, args=args, ratios=[5,4,4,3])
+        # waveform samples per latent frame
+        self.latent_hop = self.latent_upsampler.r * math.prod([5,4,4,3])
 
     ''' encode waveform into 25 hz latent representation '''
     def encode_latent(self, audio):
@@ -57,4 +65,17 @@ class WavVAE_V3(nn.Module):
         posterior = self.encode(audio)
         latent = posterior.sample().permute(0, 2, 1)  # (b, t, latent_channel)
         recon_wav = self.decode(latent)
-        return recon_wav, posterior
\ No newline at end of file
+        return recon_wav, posterior
+
+    ''' decode latent[:, start:] in windows of `chunk_frames` frames, yielding one waveform chunk per window '''
+    def decode_stream(self, latent, start=0, chunk_frames=DECODE_CHUNK_FRAMES, context=DECODE_CONTEXT):
+        # A latent frame changes the waveform from ~5.5 frames to its left up to ~6.5 frames to
+        # its right. Each window is decoded with `context` frames on both sides and cut exactly at
+        # its frame boundaries, so the chunks concatenate to the one-shot decode of latent[:, start:]
+        # and peak memory is bounded by chunk_frames + 2 * context frames.
+        n_frames = latent.size(1)
+        for chunk_start in range(start, n_frames, chunk_frames):
+            chunk_end = min(chunk_start + chunk_frames, n_frames)
+            lo, hi = max(chunk_start - context, 0), min(chunk_end + context, n_frames)
+            wav = self.decode(latent[:, lo:hi])
+            yield wav[..., (chunk_start - lo) * self.latent_hop:(chunk_end - lo) * self.latent_hop]
@@ -12,11 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import io
 import os
 import subprocess
 
 import numpy as np
+import torch
+import torchaudio
 from scipy.io import wavfile
 import pyloudnorm as pyln
 from pydub import AudioSegment
@@ -80,16 +83,62 @@ def convert_to_wav_bytes(audio_binary):
 
 
 ''' Smoothly combine audio segments using crossfade transitions." '''
-def combine_audio_segments(segments, crossfade_duration=0.16, sr=24000):
+def combine_audio_segments(segments, crossfade_duration=0.16, sr=24000, dtype=np.float32):
     window_length = int(sr * crossfade_duration)
     hanning_window = np.hanning(2 * window_length)
+    # Every segment but the first overlaps the previous one by window_length samples
+    total_length = sum(len(segment) for segment in segments) - window_length * (len(segments) - 1)
+    combined_audio = np.empty(total_length, dtype=dtype)
     # Combine
+    pos = 0
     for i, segment in enumerate(segments):
         if i == 0:
-            combined_audio = segment
+            combined_audio[:len(segment)] = segment
         else:
-            overlap = combined_audio[-window_length:] * hanning_window[window_length:] + segment[:window_length] * hanning_window[:window_length]
-            combined_audio = np.concatenate(
-                [combined_audio[:-window_length], overlap, segment[window_length:]]
-            )
-    return combined_audio
\ No newline at end of file
+            combined_audio[pos - window_length:pos] = combined_audio[pos - window_length:pos] * hanning_window[window_length:] + segment[:window_length] * hanning_window[:window_length]
+            combined_audio[pos:pos + len(segment) - window_length] = segment[window_length:]
+            pos -= window_length
+        pos += len(segment)
+    return combined_audio
+
+''' Combine latent segments (b, t, c) with crossfade transitions, to be decoded in one pass '''
+def combine_latent_segments(segments, crossfade_frames=4):
+    # 4 latent frames are 0.16s, the crossfade of combine_audio_segments
+    hanning_window = torch.from_numpy(np.hanning(2 * crossfade_frames)).to(segments[0])[None, :, None]
+    fade_in, fade_out = hanning_window[:, :crossfade_frames], hanning_window[:, crossfade_frames:]
+    # Every segment but the first overlaps the previous one by crossfade_frames frames
+    total_length = sum(segment.size(1) for segment in segments) - crossfade_frames * (len(segments) - 1)
+    combined = segments[0].new_empty(segments[0].size(0), total_length, segments[0].size(2))
+    pos = 0
+    for i, segment in enumerate(segments):
+        if i == 0:
+            combined[:, :segment.size(1)] = segment
+        else:
+            combined[:, pos - crossfade_frames:pos] = combined[:, pos - crossfade_frames:pos] * fade_out + segment[:, :crossfade_frames] * fade_in
+            combined[:, pos:pos + segment.size(1) - crossfade_frames] = segment[:, crossfade_frames:]
+            pos -= crossfade_frames
+        pos += segment.size(1)
+    return combined
+
+
+@functools.lru_cache(maxsize=8)
+def _resampler(orig_sr, target_sr, device):
+    # windowed-sinc kernel of librosa's 'kaiser_best', built once per rate pair and device
+    return torchaudio.transforms.Resample(
+        orig_sr, target_sr, lowpass_filter_width=64, rolloff=0.9475937167399596,
+        resampling_method='sinc_interp_kaiser', beta=14.769656459379492).to(device)
+
+
+def resample(wav, orig_sr, target_sr):
+    """ Resample a float tensor of shape (..., t) on its device """
+    if orig_sr == target_sr:
+        return wav
+    return _resampler(orig_sr, target_sr, wav.device)(wav)
+
+
+def load_waveform(waveform, sample_rate, target_sr, device):
+    """ Mono float32 tensor (t,) at `target_sr` on `device` from a ComfyUI waveform of shape (c, t) """
+    wav = waveform.to(device, torch.float32)
+    if wav.dim() > 1:
+        wav = wav.mean(0)
+    return resample(wav, sample_rate, target_sr)
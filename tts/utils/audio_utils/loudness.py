@@ -0,0 +1,86 @@
+import functools
+
+import numpy as np
+import scipy.signal
+import torch
+
+# ITU-R BS.1770-4 integrated loudness of mono audio, matching pyloudnorm.Meter(rate).integrated_loudness.
+# Works on numpy arrays and on torch tensors on any device, in float32.
+BLOCK_SIZE = 0.400
+OVERLAP = 0.75
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+
+def _biquad(G, Q, fc, rate, filter_type):
+    A = 10 ** (G / 40.0)
+    w0 = 2.0 * np.pi * (fc / rate)
+    alpha = np.sin(w0) / (2.0 * Q)
+    if filter_type == 'high_shelf':
+        b = [A * ((A + 1) + (A - 1) * np.cos(w0) + 2 * np.sqrt(A) * alpha),
+             -2 * A * ((A - 1) + (A + 1) * np.cos(w0)),
+             A * ((A + 1) + (A - 1) * np.cos(w0) - 2 * np.sqrt(A) * alpha)]
+        a = [(A + 1) - (A - 1) * np.cos(w0) + 2 * np.sqrt(A) * alpha,
+             2 * ((A - 1) - (A + 1) * np.cos(w0)),
+             (A + 1) - (A - 1) * np.cos(w0) - 2 * np.sqrt(A) * alpha]
+    else:  # high_pass
+        b = [(1 + np.cos(w0)) / 2, -(1 + np.cos(w0)), (1 + np.cos(w0)) / 2]
+        a = [1 + alpha, -2 * np.cos(w0), 1 - alpha]
+    return np.array(b) / a[0], np.array(a) / a[0]
+
+
+@functools.lru_cache(maxsize=None)
+def k_weighting_filter(rate):
+    """ Second-order sections of the K-weighting pre-filter (high shelf followed by high pass) at `rate` """
+    sections = [_biquad(4.0, 1 / np.sqrt(2), 1500.0, rate, 'high_shelf'), _biquad(0.0, 0.5, 38.0, rate, 'high_pass')]
+    return np.array([np.concatenate([b, a]) for b, a in sections])
+
+
+@functools.lru_cache(maxsize=16)
+def k_weighting_response(rate, n_fft, device):
+    z_inv = np.exp(-2j * np.pi * np.arange(n_fft // 2 + 1) / n_fft)
+    response = np.prod([np.polyval(sos[2::-1], z_inv) / np.polyval(sos[:2:-1], z_inv) for sos in k_weighting_filter(rate)], axis=0)
+    return torch.from_numpy(response.astype(np.complex64)).to(device)
+
+
+def k_weighting(wav, rate):
+    """
+    K-weight a float32 tensor of shape (t,). On the CPU the filter runs in the time domain. On other
+    devices it is applied as its frequency response on an FFT zero-padded by at least one second,
+    where its impulse response has long decayed, so that the result equals the causal filter output.
+    """
+    if wav.device.type == 'cpu':
+        return torch.from_numpy(scipy.signal.sosfilt(k_weighting_filter(rate).astype(np.float32), wav.numpy()))
+    n_fft = 1 << (wav.size(-1) + rate - 1).bit_length()
+    spec = torch.fft.rfft(wav, n=n_fft) * k_weighting_response(rate, n_fft, wav.device)
+    return torch.fft.irfft(spec, n=n_fft)[:wav.size(-1)]
+
+
+def integrated_loudness(wav, rate):
+    """ Gated loudness in LUFS of mono audio `wav` (numpy array or tensor of shape (t,)) """
+    if not isinstance(wav, torch.Tensor):
+        wav = torch.from_numpy(np.asarray(wav, dtype=np.float32))
+    wav = wav.to(torch.float32)
+    block = round(BLOCK_SIZE * rate)
+    step = round(BLOCK_SIZE * (1 - OVERLAP) * rate)
+    if wav.size(-1) < block:
+        raise ValueError("Audio must have length greater than the block size.")
+
+    energy = k_weighting(wav, rate).square()
+    # mean square of every gating block; the last block may run past the end of the signal
+    n_blocks = int(np.round((wav.size(-1) / rate - BLOCK_SIZE) / (BLOCK_SIZE * (1 - OVERLAP)))) + 1
+    energy = torch.nn.functional.pad(energy, [0, max((n_blocks - 1) * step + block - energy.size(-1), 0)])
+    z = energy.unfold(-1, block, step)[:n_blocks].mean(-1)
+    block_loudness = -0.691 + 10.0 * torch.log10(z)
+
+    gated = block_loudness >= ABSOLUTE_GATE
+    relative_gate = -0.691 + 10.0 * torch.log10(z[gated].mean()) + RELATIVE_GATE
+    gated = (block_loudness > relative_gate) & (block_loudness > ABSOLUTE_GATE)
+    if not gated.any():
+        return float('-inf')
+    return (-0.691 + 10.0 * torch.log10(z[gated].mean())).item()
+
+
+def normalize_loudness(wav, loudness, target_loudness):
+    """ Scale `wav` (numpy array or tensor) from `loudness` to `target_loudness` LUFS """
+    return wav * 10.0 ** ((target_loudness - loudness) / 20.0)
@@ -0,0 +1,196 @@
+import os
+import unicodedata
+from collections import OrderedDict
+
+import torch
+
+# Bump whenever the layout of the stored lexicon changes.
+LEXICON_VERSION = 1
+# phone ids of punctuation (146~173 in the phone dict)
+PUNCT_PH_MIN, PUNCT_PH_MAX = 146, 173
+
+
+def _is_punct(char):
+    return unicodedata.category(char).startswith('P')
+
+
+def split_text_clauses(text):
+    """Split text after every run of punctuation, e.g. 'a, b.' -> ['a,', 'b.']."""
+    clauses, start = [], 0
+    for i, char in enumerate(text):
+        if _is_punct(char) and (i + 1 == len(text) or not _is_punct(text[i + 1])):
+            clauses.append(text[start:i + 1].strip())
+            start = i + 1
+    if text[start:].strip():
+        clauses.append(text[start:].strip())
+    return clauses
+
+
+def split_phone_clauses(ph_tokens):
+    """Split G2P phone ids (t,) after every run of punctuation phones."""
+    is_punct = ((ph_tokens >= PUNCT_PH_MIN) & (ph_tokens <= PUNCT_PH_MAX)).tolist()
+    clauses, start = [], 0
+    for i, punct in enumerate(is_punct):
+        if punct and (i + 1 == len(is_punct) or not is_punct[i + 1]):
+            clauses.append(ph_tokens[start:i + 1])
+            start = i + 1
+    if start < len(is_punct):
+        clauses.append(ph_tokens[start:])
+    return clauses
+
+
+class G2PCache:
+    """Two-level cache of G2P outputs (phone ids before `split_ph`).
+
+    - segments: LRU of whole segments, keyed by the normalized segment text.
+    - lexicon: punctuation-delimited clause -> phone ids, learned from every G2P output whose
+      punctuation lines up with the text. A segment made only of known clauses is answered from
+      it. The G2P LM reads context (polyphones, tone sandhi), so clauses are the smallest unit
+      that is learned. The lexicon is saved to `path`, loaded memory-mapped, and dropped when
+      `ckpt_key` (the G2P checkpoint fingerprint) changes.
+
+    Sequences begin with `start_ph`, the phone the G2P prompt ends with.
+    """
+
+    def __init__(self, path, ckpt_key, start_ph, max_segments=4096, max_clauses=65536):
+        self.path = path
+        self.ckpt_key = ckpt_key
+        self.start_ph = start_ph
+        self.max_segments = max_segments
+        self.max_clauses = max_clauses
+        self.segments = OrderedDict()
+        self.lexicon = OrderedDict()
+        self.dirty = False
+        self.segment_hits = 0
+        self.lexicon_hits = 0
+        self.misses = 0
+        self.load()
+
+    def get(self, text):
+        key = text.strip()
+        if key in self.segments:
+            self.segments.move_to_end(key)
+            self.segment_hits += 1
+            return self.segments[key]
+        clauses = split_text_clauses(key)
+        if clauses and all(clause in self.lexicon for clause in clauses):
+            for clause in clauses:
+                self.lexicon.move_to_end(clause)
+            self.lexicon_hits += 1
+            ph_tokens = torch.cat([torch.LongTensor([self.start_ph])] + [self.lexicon[clause] for clause in clauses])
+            self._put_segment(key, ph_tokens)
+            return ph_tokens
+        self.misses += 1
+        return None
+
+    def put(self, text, ph_tokens):
+        key = text.strip()
+        ph_tokens = ph_tokens.cpu()
+        self._put_segment(key, ph_tokens)
+        if len(ph_tokens) == 0 or ph_tokens[0] != self.start_ph:
+            return
+        # learn only when text and phones split into the same clauses, ending in punctuation alike
+        text_clauses, phone_clauses = split_text_clauses(key), split_phone_clauses(ph_tokens[1:])
+        if len(text_clauses) != len(phone_clauses):
+            return
+        for clause, phones in zip(text_clauses, phone_clauses):
+            if _is_punct(clause[-1]) != (PUNCT_PH_MIN <= int(phones[-1]) <= PUNCT_PH_MAX):
+                return
+        for clause, phones in zip(text_clauses, phone_clauses):
+            if clause not in self.lexicon or not torch.equal(self.lexicon[clause], phones):
+                self.lexicon[clause] = phones.clone()
+                self.dirty = True
+            self.lexicon.move_to_end(clause)
+        while len(self.lexicon) > self.max_clauses:
+            self.lexicon.popitem(last=False)
+
+    def can_draft(self, text):
+        """Whether `draft` may propose anything for segment `text`, i.e. one of its clauses is known."""
+        return any(clause in self.lexicon for clause in split_text_clauses(text.strip()))
+
+    def draft(self, text, ph_tokens):
+        """
+        Guess the phones that follow `ph_tokens` (list of the phone ids generated so far for segment
+        `text`, without `start_ph`) from the lexicon: the rest of the current clause and the clauses
+        after it, as far as they are known. Returns (phones, complete), `complete` when they reach
+        the end of the segment.
+        """
+        clauses = split_text_clauses(text.strip())
+        done = split_phone_clauses(torch.LongTensor(ph_tokens))
+        partial = done.pop().tolist() if done else []
+        # a trailing punctuation run may still grow, the clause is over only if it matches the lexicon
+        if len(done) < len(clauses) and PUNCT_PH_MIN <= (partial or [0])[-1] <= PUNCT_PH_MAX \
+                and clauses[len(done)] in self.lexicon and self.lexicon[clauses[len(done)]].tolist() == partial:
+            done.append(partial)
+            partial = []
+        phones = []
+        for clause in clauses[len(done):]:
+            if clause not in self.lexicon:
+                return phones, False
+            clause_phones = self.lexicon[clause].tolist()
+            if clause_phones[:len(partial)] != partial:
+                return phones, False
+            phones += clause_phones[len(partial):]
+            partial = []
+        return phones, not partial
+
+    def _put_segment(self, key, ph_tokens):
+        self.segments[key] = ph_tokens
+        self.segments.move_to_end(key)
+        while len(self.segments) > self.max_segments:
+            self.segments.popitem(last=False)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            lexicon = torch.load(self.path, map_location='cpu', mmap=True, weights_only=True)
+        except Exception as e:
+            print(f"| WARN: failed to load G2P lexicon '{self.path}': {e}")
+            return
+        if lexicon.get('version') != LEXICON_VERSION or lexicon.get('ckpt_key') != self.ckpt_key:
+            return
+        # entries are views into the memory-mapped token buffer
+        offsets = lexicon['offsets'].tolist()
+        for i, clause in enumerate(lexicon['clauses'][-self.max_clauses:], max(len(lexicon['clauses']) - self.max_clauses, 0)):
+            self.lexicon[clause] = lexicon['tokens'][offsets[i]:offsets[i + 1]]
+
+    def save(self):
+        """Write the lexicon if it changed, through a temporary file so a crash never truncates it."""
+        if not self.path or not self.dirty:
+            return
+        offsets = torch.LongTensor([0] + [len(phones) for phones in self.lexicon.values()]).cumsum(0)
+        tokens = torch.cat(list(self.lexicon.values())) if self.lexicon else torch.LongTensor([])
+        # point the entries at the new buffer, which releases the mapping of the file being replaced
+        for i, clause in enumerate(self.lexicon):
+            self.lexicon[clause] = tokens[offsets[i]:offsets[i + 1]]
+        lexicon = {
+            'version': LEXICON_VERSION,
+            'ckpt_key': self.ckpt_key,
+            'clauses': list(self.lexicon.keys()),
+            'offsets': offsets,
+            'tokens': tokens,
+        }
+        tmp_path = f'{self.path}.tmp{os.getpid()}'
+        try:
+            torch.save(lexicon, tmp_path)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except OSError as e:
+            print(f"| WARN: failed to save G2P lexicon '{self.path}': {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def clear(self):
+        self.segments.clear()
+
+    def stats(self):
+        lookups = self.segment_hits + self.lexicon_hits + self.misses
+        return {
+            'segments': len(self.segments),
+            'clauses': len(self.lexicon),
+            'segment_hits': self.segment_hits,
+            'lexicon_hits': self.lexicon_hits,
+            'misses': self.misses,
+            'hit_rate': (self.segment_hits + self.lexicon_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,113 @@
+import hashlib
+from collections import OrderedDict
+
+import torch
+
+
+def hash_bytes(*chunks):
+    """Content hash of bytes, strings and tensors, used as the key of cached speaker prompt states."""
+    h = hashlib.blake2b(digest_size=16)
+    for chunk in chunks:
+        if chunk is None:
+            chunk = b''
+        elif isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        elif isinstance(chunk, torch.Tensor):
+            h.update(f'{chunk.dtype}{tuple(chunk.shape)}'.encode('utf-8'))
+            chunk = memoryview(chunk.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy())
+        h.update(len(chunk).to_bytes(8, 'little'))
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def audio_fingerprint(waveform, sample_rate):
+    """Content hash of a waveform tensor and its sample rate, streamed over the raw bytes."""
+    return hash_bytes(waveform, str(sample_rate))
+
+
+def file_fingerprint(path):
+    """Content hash of a file, or of nothing if there is no path."""
+    if not path:
+        return hash_bytes(None)
+    with open(path, 'rb') as f:
+        return hash_bytes(f.read())
+
+
+def state_nbytes(state):
+    """Number of bytes held by all tensors in a (nested) prompt state."""
+    if isinstance(state, torch.Tensor):
+        return state.numel() * state.element_size()
+    if isinstance(state, dict):
+        return sum(state_nbytes(v) for v in state.values())
+    if isinstance(state, (list, tuple)):
+        return sum(state_nbytes(v) for v in state)
+    if hasattr(state, 'to_state'):  # kv arenas of the duration LM
+        return state_nbytes(state.to_state())
+    return 0
+
+
+class PromptStateCache:
+    """Size-bounded LRU of preprocessed speaker prompt states.
+
+    Each entry holds everything `MegaTTS3DiTInfer.preprocess` derives from one prompt
+    (alignment, VAE latent, duration-LM prompt state, loudness), so switching back to
+    a recently used voice skips the aligner, the WavVAE encoder and the duration prompt.
+    Entries are evicted least-recently-used first once `max_bytes` is exceeded.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._states = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, key):
+        return key in self._states
+
+    def get(self, key):
+        if key not in self._states:
+            self.misses += 1
+            return None
+        self._states.move_to_end(key)
+        self.hits += 1
+        return self._states[key][0]
+
+    def put(self, key, state):
+        if key in self._states:
+            self.nbytes -= self._states.pop(key)[1]
+        size = state_nbytes(state)
+        if size > self.max_bytes:
+            return
+        self._states[key] = (state, size)
+        self.nbytes += size
+        self._evict()
+
+    def resize(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted_size) = self._states.popitem(last=False)
+            self.nbytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self._states.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._states),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0,
+        }
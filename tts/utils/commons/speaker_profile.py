@@ -0,0 +1,79 @@
+import glob
+import os
+
+import torch
+
+from tts.utils.commons.prompt_cache import hash_bytes
+
+# Bump whenever the layout of a stored prompt state changes.
+PROFILE_VERSION = 2
+PROFILE_SUFFIX = '.megatts3'
+
+
+def profile_path_for(wav_path):
+    return wav_path.rsplit('.', 1)[0] + PROFILE_SUFFIX
+
+
+def checkpoint_fingerprint(*exp_dirs, extra=None, patterns=('*.ckpt', 'config.yaml')):
+    """Cheap fingerprint of the checkpoints a speaker profile depends on (path, size and mtime)."""
+    chunks = [str(extra)]
+    for exp_dir in exp_dirs:
+        for path in sorted(sum([glob.glob(f'{exp_dir}/{pattern}') for pattern in patterns], [])):
+            st = os.stat(path)
+            chunks.append(f'{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}')
+    return hash_bytes(*chunks)
+
+
+def _to_device(obj, device):
+    if isinstance(obj, torch.Tensor):
+        return obj.to(device)
+    if isinstance(obj, dict):
+        return {k: _to_device(v, device) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_to_device(v, device) for v in obj]
+    return obj
+
+
+def save_speaker_profile(path, state, prompt_key, ckpt_key, dur_model):
+    """Serialize a prompt state produced by `MegaTTS3DiTInfer.build_prompt_state`.
+
+    The file is written to a temporary name first and moved into place, so a crashed
+    run never leaves a truncated profile behind.
+    """
+    state = dict(state)
+    state['incremental_state_dur_prompt'] = dur_model.export_incremental_state(state['incremental_state_dur_prompt'])
+    profile = {
+        'version': PROFILE_VERSION,
+        'prompt_key': prompt_key,
+        'ckpt_key': ckpt_key,
+        'state': _to_device(state, 'cpu'),
+    }
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    try:
+        torch.save(profile, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"| WARN: failed to save speaker profile '{path}': {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_speaker_profile(path, prompt_key, ckpt_key, dur_model, device):
+    """Load a speaker profile memory-mapped.
+
+    Returns None when the file is missing, unreadable, of another version, or was made
+    from a different prompt or with different checkpoints.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        profile = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except Exception as e:
+        print(f"| WARN: failed to load speaker profile '{path}': {e}")
+        return None
+    if (profile.get('version') != PROFILE_VERSION or profile.get('prompt_key') != prompt_key
+            or profile.get('ckpt_key') != ckpt_key):
+        return None
+    state = _to_device(profile['state'], device)
+    state['incremental_state_dur_prompt'] = dur_model.import_incremental_state(state['incremental_state_dur_prompt'])
+    return state
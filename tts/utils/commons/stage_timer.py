@@ -0,0 +1,43 @@
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+
+class StageTimer:
+    """Wall-clock time spent in each named stage of a request, accumulated over all segments.
+
+    CUDA is synchronized around every stage so that asynchronous kernels are charged to the
+    stage that launched them. A disabled timer neither syncs nor measures anything.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.totals = OrderedDict()
+        self.notes = {}
+
+    def _sync(self):
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        self._sync()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._sync()
+            self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+
+    def note(self, name, text):
+        self.notes[name] = text
+
+    def report(self):
+        return ', '.join(
+            f'{name} {total:.2f}s' + (f' ({self.notes[name]})' if name in self.notes else '')
+            for name, total in self.totals.items())
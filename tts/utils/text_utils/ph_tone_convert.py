@@ -17,78 +17,40 @@ import torch.nn.functional as F
 
 def map_phone_to_tokendict(item, pad_bos_eos=True):
     # Merge Chinese phone and tone (Original dict ends at 173, i.e., ph_dict_size=173). 146~173 is punctuations.
-    phone = item['txt_token'].clone()
-    merged_phone = item['txt_token'].clone()
-    tone_tmp = item['tone'].clone()
+    phone = item['txt_token']
+    tone = item['tone']
     # In tone_dict, tone_1 is 4, tone_2 is 11, tone_3 is 12, tone_4 is 13, tone_5 is 14, tone_6 is 15
-    tone_tmp[tone_tmp==4] = 1
-    tone_tmp[tone_tmp==11] = 2
-    tone_tmp[tone_tmp==12] = 3
-    tone_tmp[tone_tmp==13] = 4
-    tone_tmp[tone_tmp==14] = 5
-    tone_tmp[tone_tmp==15] = 6
+    tone = torch.where(tone == 4, 1, torch.where((tone >= 11) & (tone <= 15), tone - 9, tone))
     # Chinese phones lie in 3~100 in the phone_dict, we map them to 200~788
     ch_phone_idx = (phone >= 3) & (phone <= 100)
-    merged_phone[ch_phone_idx] = (merged_phone[ch_phone_idx] - 3) * 6 + 200 + tone_tmp[ch_phone_idx]
+    merged_phone = torch.where(ch_phone_idx, (phone - 3) * 6 + 200 + tone, phone)
 
     if pad_bos_eos:
         merged_phone = F.pad(merged_phone, (1, 0), mode='constant', value=798)
         merged_phone = F.pad(merged_phone, (0, 1), mode='constant', value=799)
     return merged_phone
-    
+
+def _split_merged_phone(merged_phone):
+    # Map Chinese phones back to its original phone_dict, set English tone to '3'
+    ch_phone_idx = (merged_phone >= 200) & (merged_phone <= 788)
+    ph = torch.where(ch_phone_idx, torch.div(merged_phone - 200 - 1, 6, rounding_mode='floor') + 3, merged_phone)
+    tone = torch.remainder(merged_phone - 200 - 1, 6) + 1
+    tone = torch.where(ch_phone_idx, torch.where(tone == 1, 4, tone + 9), 3)
+    return ph, tone
+
 def split_ph_timestamp(ph_timestamp):
-    ''' Input: ph_timestamp, shape [T] '''
+    ''' Input: ph_timestamp, shape [T], phones and the end frames of the phones interleaved '''
 
     # Map the timestamp of each phone back to its original frame-level lengths
-    ph_timestamp[ph_timestamp >= 800] -= 800
+    ph_timestamp = ph_timestamp.long()
+    ph_timestamp = torch.where(ph_timestamp >= 800, ph_timestamp - 800, ph_timestamp)
 
-    ph_list = []
-    tone_list = []
-    dur_list = []
-    cur_timestamp = 0
-    for idx, item in enumerate(ph_timestamp):
-        if idx % 2 == 0:
-            # Map Chinese phones back to its original phone_dict
-            if (200 <= item <= 788):
-                ph = (item - 200 - 1) // 6 + 3
-                tone = (item - 200 - 1) % 6 + 1
-                if tone == 1:
-                    tone = 4
-                else:
-                    tone = tone + 9
-            # Set English tone to '3'
-            else:
-                ph = item
-                tone = 3
-            ph_list.append(ph)
-            tone_list.append(tone)
-        else:
-            dur_list.append((item - cur_timestamp))
-            cur_timestamp = item
-    assert len(ph_list) == len(dur_list), f"{len(ph_list)}, {len(dur_list)}"
-    ph_seq, tone_seq, dur_seq = torch.LongTensor(ph_list), torch.LongTensor(tone_list), torch.LongTensor(dur_list)
+    merged_phone, timestamp = ph_timestamp[0::2], ph_timestamp[1::2]
+    assert len(merged_phone) == len(timestamp), f"{len(merged_phone)}, {len(timestamp)}"
+    ph_seq, tone_seq = _split_merged_phone(merged_phone)
+    dur_seq = torch.diff(timestamp, prepend=timestamp.new_zeros(1))
     return ph_seq, tone_seq, dur_seq, ph_timestamp[-1]
-    
+
 def split_ph(ph_seq):
-    ''' Input: ph_timestamp, shape [T] '''
-    ph_list = []
-    tone_list = []
-    for idx, item in enumerate(ph_seq):
-        # Map Chinese phones back to its original phone_dict
-        if (200 <= item <= 788):
-            ph = (item - 200 - 1) // 6 + 3
-            tone = (item - 200 - 1) % 6 + 1
-            if tone == 1:
-                tone = 4
-            else:
-                tone = tone + 9
-        # Set English tone to '3'
-        else:
-            ph = item
-            tone = 3
-        ph_list.append(ph)
-        tone_list.append(tone)
-        
-    assert len(ph_list) == len(tone_list)
-    ph_seq, tone_seq = torch.LongTensor(ph_list), torch.LongTensor(tone_list)
-    return ph_seq, tone_seq
\ No newline at end of file
+    ''' Input: ph_seq, shape [T] '''
+    return _split_merged_phone(ph_seq.long())